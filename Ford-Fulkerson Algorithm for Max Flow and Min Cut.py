@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-"""Solution of 460 Graphs - Flows and Cuts - assignment
+r"""Solution of 460 Graphs - Flows and Cuts - assignment
 
 Automatically generated by Colab.
 
@@ -231,11 +231,329 @@ G = [#  A   B   C   D   E
      [  0,  0,  0,  0,  0]  # E
 ]
 
+import asyncio # to solve off the event loop in AnytimeMaxFlow.run_async
+import bisect # to find arcs in the sorted rows of a ResidualGraph
 import copy # to make deep copy
+import json # to save Gomory-Hu trees
+import mmap # to read binary edge lists
+import os # to size the process pool of solve_batch
+import platform # to label benchmark results
+import random # to generate benchmark graphs
+import sys # for the command line
+import threading # to run one slice of an AnytimeMaxFlow at a time
+import time # to time benchmarks and solver phases
+import tracemalloc # to measure peak memory in benchmarks
+from array import array # compact integer storage for the sparse residual graph
+from collections import deque # queue of active pixels in boykov_kolmogorov
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np # optional; only the 'numpy' engine needs it
+except ImportError:
+    np = None
+
+
+class ResidualGraph:
+    """Sparse residual graph in compressed sparse row (CSR) form.
+
+    Every edge u --> v of the input graph is stored as a pair of arcs: a forward
+    arc leaving u, whose residual capacity starts at the edge's capacity, and a
+    reverse arc leaving v, whose residual capacity starts at 0. Pushing flow
+    along an arc takes capacity from it and gives the same amount to its pair,
+    which is the skew symmetry property without an adjacency matrix.
+
+    The arcs leaving vertex u occupy positions start[u] to start[u+1]-1 of the
+    arc arrays, sorted by the vertex they point to. Memory grows with the number
+    of edges instead of the square of the number of vertices.
+
+    Inputs
+    ------
+    edges : iterable
+      (u, v, capacity) tuples; edges with capacity 0 and self-loops are ignored
+    n : int
+      number of vertices; defaults to one more than the largest vertex label
+    merge : bool
+      whether to merge parallel edges into one edge with their total capacity
+
+    Attributes
+    ----------
+    n : int
+      number of vertices
+    start : array
+      start[u] is the position of the first arc leaving u; start[n] is the
+      number of arcs
+    head : array
+      head[a] is the vertex arc a points to
+    rev : array
+      rev[a] is the position of the arc paired with arc a
+    cap : list
+      cap[a] is the residual capacity of arc a
+    capacity : list
+      capacity[a] is the input capacity of arc a; 0 for reverse arcs
+    """
+
+    def __init__(self, edges, n=None, merge=False):
+        tails = array('q')
+        heads = array('q')
+        caps = []
+        for u, v, c in edges:
+            if c > 0 and u != v:
+                tails.append(u)
+                heads.append(v)
+                caps.append(c)
+        self._build(tails, heads, caps, n, merge)
+
+    @classmethod
+    def from_arrays(cls, tails, heads, caps, n=None, merge=False):
+        """Builds a residual graph from three parallel sequences of edge tails,
+        heads and capacities, which must hold no zero capacities or self-loops.
+        Compact arrays keep the memory of large inputs low while they load."""
+        graph = cls.__new__(cls)
+        graph._build(tails, heads, caps, n, merge)
+        return graph
+
+    @staticmethod
+    def _sorted(order, key, n):
+        # Stable counting sort of the items in order by key(item), 0 <= key < n
+        count = [0] * (n + 1)
+        for k in order:
+            count[key(k) + 1] += 1
+        for u in range(n):
+            count[u + 1] += count[u]
+        placed = array('q', bytes(8 * len(order)))
+        for k in order:
+            u = key(k)
+            placed[count[u]] = k
+            count[u] += 1
+        return placed
+
+    def _build(self, tails, heads, caps, n, merge):
+        if n is None:
+            n = max(max(tails), max(heads)) + 1 if tails else 0
+
+        if merge:
+            # Sort the edges by tail and head, so parallel edges are next to
+            # each other, and add up their capacities
+            order = self._sorted(range(len(tails)), heads.__getitem__, n)
+            order = self._sorted(order, tails.__getitem__, n)
+            merged_tails, merged_heads, merged_caps = array('q'), array('q'), []
+            for i in order:
+                if (merged_tails and merged_tails[-1] == tails[i]
+                        and merged_heads[-1] == heads[i]):
+                    merged_caps[-1] += caps[i]
+                else:
+                    merged_tails.append(tails[i])
+                    merged_heads.append(heads[i])
+                    merged_caps.append(caps[i])
+            tails, heads, caps = merged_tails, merged_heads, merged_caps
+
+        m = 2 * len(tails)  # arc 2i is the forward arc of edge i, 2i+1 its pair
+
+        def arc_tail(k):
+            return tails[k >> 1] if k & 1 == 0 else heads[k >> 1]
+
+        def arc_head(k):
+            return heads[k >> 1] if k & 1 == 0 else tails[k >> 1]
+
+        # Two stable counting sorts, first by head and then by tail, leave the
+        # arcs grouped by tail and ordered by head within each group.
+        order = self._sorted(self._sorted(range(m), arc_head, n), arc_tail, n)
+
+        position = array('q', bytes(8 * m))
+        for a in range(m):
+            position[order[a]] = a
+
+        self.n = n
+        self.start = array('q', bytes(8 * (n + 1)))
+        for k in range(m):
+            self.start[arc_tail(k) + 1] += 1
+        for u in range(n):
+            self.start[u + 1] += self.start[u]
+        self.head = array('q', (arc_head(k) for k in order))
+        self.rev = array('q', (position[k ^ 1] for k in order))
+        self.capacity = [caps[k >> 1] if k & 1 == 0 else 0 for k in order]
+        self.cap = list(self.capacity)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Builds a residual graph from an adjacency matrix such as G."""
+        return cls(((u, v, c) for u, row in enumerate(matrix)
+                    for v, c in enumerate(row) if c > 0), len(matrix))
+
+    def copy(self):
+        """Returns a residual graph that shares the topology but not the
+        residual capacities, the sparse counterpart of copy.deepcopy(graph)."""
+        other = copy.copy(self)
+        other.cap = list(self.cap)
+        return other
+
+    def edges(self):
+        """Yields the (u, v, capacity) edges of the input graph."""
+        start, head, capacity = self.start, self.head, self.capacity
+        for u in range(self.n):
+            for a in range(start[u], start[u + 1]):
+                if capacity[a] > 0:
+                    yield u, head[a], capacity[a]
+
+
+class SolverStats(dict):
+    """Counters, timers and progress callbacks of max-flow computations.
+
+    A SolverStats is the dict of counters that ff_with_min_cut and the engines
+    fill in when one is passed as stats, such as augmentations and
+    edges_scanned, and the seconds spent in each phase: path_search_seconds,
+    residual_update_seconds and cut_seconds. On top of that it records the
+    length and bottleneck of every augmenting path, and calls
+    callback(stats) every `every` augmentations, e.g. to report progress.
+
+    Inputs
+    ------
+    callback : function
+      optional function called with the SolverStats every `every` augmentations
+    every : int
+      number of augmentations between two calls of callback
+    paths : bool
+      whether to keep the length and bottleneck of every augmenting path in
+      path_lengths and bottlenecks; only their totals and extremes otherwise
+    """
+
+    def __init__(self, callback=None, every=1, paths=True):
+        super().__init__()
+        self.callback = callback
+        self.every = every
+        self.paths = paths
+        self.path_lengths = []
+        self.bottlenecks = []
+
+    def augmented(self, length, bottleneck):
+        """Records an augmenting path of length arcs that moved bottleneck units."""
+        count = self['augmentations'] = self.get('augmentations', 0) + 1
+        self['path_arcs'] = self.get('path_arcs', 0) + length
+        self['longest_path'] = max(self.get('longest_path', 0), length)
+        self['smallest_bottleneck'] = min(self.get('smallest_bottleneck', bottleneck), bottleneck)
+        self['largest_bottleneck'] = max(self.get('largest_bottleneck', bottleneck), bottleneck)
+        if self.paths:
+            self.path_lengths.append(length)
+            self.bottlenecks.append(bottleneck)
+        if self.callback is not None and count % self.every == 0:
+            self.callback(self)
+
+    def to_dict(self):
+        """Returns the counters and timers, and the path lengths and bottlenecks
+        when they are kept, as a plain dict."""
+        result = dict(self)
+        if self.paths:
+            result['path_lengths'] = list(self.path_lengths)
+            result['bottlenecks'] = list(self.bottlenecks)
+        return result
+
+    def to_json(self, **kwargs):
+        """Returns to_dict() as a JSON string; kwargs go to json.dumps."""
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+def tally(stats, **counts):
+  """Adds counts to a stats dict, such as the one ff_with_min_cut fills in.
+  Does nothing when stats is None."""
+  if stats is not None:
+    for key, value in counts.items():
+      stats[key] = stats.get(key, 0) + value
+
+
+def augmented(stats, length, bottleneck):
+  """Counts an augmenting path of length arcs with the given bottleneck in
+  stats; a SolverStats also records the path and runs its callback."""
+  if isinstance(stats, SolverStats):
+    stats.augmented(length, bottleneck)
+  elif stats is not None:
+    stats['augmentations'] = stats.get('augmentations', 0) + 1
+
+
+def clock(stats):
+  """Starts timing a phase: returns the current time, or None when stats is
+  None, so that solves without stats do not read the clock."""
+  if stats is not None:
+    return time.perf_counter()
+
+
+def lap(stats, key, since):
+  """Adds the seconds elapsed since a time returned by clock or lap to
+  stats[key], and returns the current time to time the next phase from."""
+  if stats is not None:
+    now = time.perf_counter()
+    stats[key] = stats.get(key, 0) + now - since
+    return now
+
+
+def find_arc_path(residual_graph, source, target, visited=None, parent=None,
+                  stats=None, delta=0):
+  """Finds an augmenting path in a sparse residual graph.
 
+  Inputs
+  ------
+  residual_graph : ResidualGraph
+    residual graph to search
+  source, target : int
+    The two vertices at both ends of the path
+  visited, parent : bytearray, list
+    optional scratch buffers of n entries, as in find_path
+  stats : dict
+    optional counters, as in find_path
+  delta : int
+    minimum residual capacity of the arcs to follow, as in find_path
 
-def find_path(graph, source, target, path):
-  """Finds a path between two vertices in a directed acyclic graph.
+  Returns
+  -------
+  path : list
+    positions of the arcs along the path; None if path doesn't exist.
+  """
+  start, head, cap = residual_graph.start, residual_graph.head, residual_graph.cap
+  if visited is None:
+    visited = bytearray(residual_graph.n)
+  if parent is None:
+    parent = [0] * residual_graph.n
+
+  # Same search as find_path, except that parent[v] is the arc that reached v
+  visited[source] = 1
+  seen = [source]
+  stack = [source]
+  found = source == target
+  scanned = 0
+  while stack and not found:
+    u = stack.pop()
+    scanned += start[u + 1] - start[u]
+    for a in range(start[u], start[u + 1]):
+      v = head[a]
+      if cap[a] > 0 and not visited[v] and cap[a] >= delta:
+        visited[v] = 1
+        seen.append(v)
+        parent[v] = a
+        if v == target:
+          found = True
+          break
+        stack.append(v)
+
+  for v in seen:
+    visited[v] = 0
+  tally(stats, edges_scanned=scanned)
+  if not found:
+    return None
+
+  path = []
+  v = target
+  while v != source:
+    a = parent[v]
+    path.append(a)
+    v = head[residual_graph.rev[a]]  # the tail of arc a
+  path.reverse()
+  return path
+
+
+def find_path(graph, source, target, path=None, visited=None, parent=None,
+              stats=None, delta=0):
+  """Finds a path between two vertices in a directed graph.
 
   Inputs
   ------
@@ -244,47 +562,92 @@ def find_path(graph, source, target, path):
   source, target : int
     The two vertices at both ends of the path
   path : list
-    path from previous recursive call; [] for initial call
+    list to write the path into; a new list by default
+  visited : bytearray
+    optional scratch buffer of len(graph) zero bytes; it is zeroed again before
+    returning, so one buffer can serve every search of a max-flow computation
+  parent : list
+    optional scratch buffer of len(graph) entries for the parent pointers
+  stats : dict
+    optional counters; edges_scanned is increased by the number of matrix
+    entries (or arcs) examined
+  delta : int
+    only edges with at least delta capacity are followed; by default, every
+    edge with a positive capacity is
 
   Returns
   -------
   path : list
     vertices along the path from source to vertex; None if path doesn't exist.
   """
-  # The source is always part of the path
-  path.append(source)
-
-  # Base case
-  if source == target:
-    return path
-
-  # Consider every vertex adjacent to the source; because we use adjacency
-  # matrix representation, we examine the row corresponding to the source
-  # vertex: graph[source]. Every element in that row that is not zero represents
-  # an edge. If the vertex on the other side of that edge is not already in the
-  # path, we add it to the path. Then we ask if there is a parth from that
-  # vertex to the target vertex.
-  for v in range(len(graph)):
-    if graph[source][v] > 0:
-      if v not in path:
-        possible_path = find_path(graph, v, target, path)
-        if possible_path:
-          return path
-  return None
-
-
-def ff(graph, source, target):
+  # Sparse graphs are searched arc by arc; the path is reported as vertices
+  if isinstance(graph, ResidualGraph):
+    arcs = find_arc_path(graph, source, target, visited, parent, stats, delta)
+    if arcs is None:
+      return None
+    return [source] + [graph.head[a] for a in arcs]
+
+  if path is None:
+    path = []
+  if visited is None:
+    visited = bytearray(len(graph))
+  if parent is None:
+    parent = [0] * len(graph)
+
+  # Instead of recursing once per vertex, we keep the vertices still to explore
+  # on a stack. A vertex is marked as visited, and remembers the vertex it was
+  # reached from (its parent), as soon as it is found; so every vertex is pushed
+  # once, every row of the adjacency matrix is examined at most once, and we
+  # stop as soon as the target is found. The vertices we marked are listed in
+  # seen, so that the visited buffer can be zeroed without a full pass over it.
+  visited[source] = 1
+  seen = [source]
+  stack = [source]
+  found = source == target
+  scanned = 0
+  while stack and not found:
+    u = stack.pop()
+    scanned += len(graph)
+    for v, capacity in enumerate(graph[u]):
+      if capacity > 0 and not visited[v] and capacity >= delta:
+        visited[v] = 1
+        seen.append(v)
+        parent[v] = u
+        if v == target:
+          found = True
+          break
+        stack.append(v)
+
+  for v in seen:
+    visited[v] = 0
+  tally(stats, edges_scanned=scanned)
+  if not found:
+    return None
+
+  # Follow the parent pointers back from the target to rebuild the path
+  path.append(target)
+  v = target
+  while v != source:
+    v = parent[v]
+    path.append(v)
+  path.reverse()
+  return path
+
+
+def ff(graph, source, target, algorithm='ford-fulkerson'):
   """Finds the maximum flow across a flow graph and identifies the minimum cuts
   that will disable the flow between a source and a target vertex in the graph.
 
   Inputs
   ------
-  graph : list
-    adjacency matrix of the input graph
+  graph : list or ResidualGraph
+    adjacency matrix or sparse residual graph of the input graph
   source : int
     label of the source vertex
   target : int
     label of the target vertex
+  algorithm : str
+    name of the engine to use; see ENGINES. The default is the process below.
 
   Returns
   -------
@@ -293,6 +656,14 @@ def ff(graph, source, target):
   min_cuts : list
     The small set of edges that can reduce the graph's flow to 0.
   """
+  # Other engines are documented with solve()
+  if algorithm != 'ford-fulkerson':
+    return solve(graph, source, target, algorithm)[0]
+
+  # A sparse graph has no matrix to index below; its engine runs the same process
+  if isinstance(graph, ResidualGraph):
+    return ford_fulkerson(graph, source, target)[0]
+
 
   # Variable to return
   max_flow = 0
@@ -357,6 +728,21 @@ def ff(graph, source, target):
 
 def bfs_reachable_nodes(graph, source):
     """Find all nodes reachable from the source in a residual graph."""
+    if np is not None and isinstance(graph, np.ndarray):
+        return bfs_frontier(graph, source)[0]
+    if isinstance(graph, ResidualGraph):
+        start, head, cap = graph.start, graph.head, graph.cap
+        visited = [False] * graph.n
+        visited[source] = True
+        queue = [source]
+        for u in queue:  # queue grows while we iterate over it
+            for a in range(start[u], start[u + 1]):  # Only the arcs leaving u
+                v = head[a]
+                if cap[a] > 0 and not visited[v]:
+                    queue.append(v)
+                    visited[v] = True
+        return visited
+
     visited = [False] * len(graph)  # Track visited nodes
     queue = [source]  # Start with the source node
     visited[source] = True  # Mark source as visited
@@ -370,11 +756,32 @@ def bfs_reachable_nodes(graph, source):
 
     return visited  # Return all reachable nodes
 
-def find_min_cut(graph, residual_graph, source):
-    """Find the edges in the minimum cut after the max flow is computed."""
-    reachable = bfs_reachable_nodes(residual_graph, source)  # Get reachable nodes
+def find_min_cut(graph, residual_graph, source, reachable=None):
+    """Find the edges in the minimum cut after the max flow is computed.
+
+    Pass reachable when the max-flow engine already knows which nodes the
+    source reaches in the residual graph; otherwise they are searched for.
+    """
+    if reachable is None:
+        reachable = bfs_reachable_nodes(residual_graph, source)  # Get reachable nodes
     min_cut = []  # Store min cut edges
 
+    if np is not None and isinstance(residual_graph, np.ndarray):
+        # One masked comparison instead of the double loop below
+        reachable = np.asarray(reachable, dtype=bool)
+        mask = reachable[:, None] & ~reachable[None, :] & (np.asarray(graph) > 0)
+        return [(int(u), int(v)) for u, v in zip(*np.nonzero(mask))]
+
+    if isinstance(residual_graph, ResidualGraph):
+        start, head = residual_graph.start, residual_graph.head
+        capacity = residual_graph.capacity
+        for u in range(residual_graph.n):
+            if reachable[u]:
+                for a in range(start[u], start[u + 1]):  # Only edges leaving u
+                    if capacity[a] > 0 and not reachable[head[a]]:
+                        min_cut.append((u, head[a]))
+        return min_cut
+
     for u in range(len(graph)):  # For every node u
         for v in range(len(graph)):  # Check all edges from u
             # If u is reachable and v is not, it's a min-cut edge
@@ -383,15 +790,65 @@ def find_min_cut(graph, residual_graph, source):
 
     return min_cut  # Return the min cut edges
 
-def ff_with_min_cut(graph, source, target):
-    """Finds max flow and minimum cut in a flow network."""
+def ford_fulkerson(graph, source, target, stats=None, delta=0):
+    """Ford-Fulkerson engine: augments along any path found by find_path.
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      adjacency matrix or sparse residual graph of the input graph
+    source, target : int
+      labels of the source and target vertices
+    stats : dict
+      optional counters: augmentations and edges_scanned are added to it, and
+      the seconds spent searching for paths and updating the residual graph
+      (see SolverStats)
+    delta : int
+      minimum residual capacity of the edges to follow, as in find_path;
+      capacity_scaling runs one call per phase
+
+    Returns
+    -------
+    max_flow : int
+      The max flow that can travel from source to target in the input graph
+    residual_graph : list or ResidualGraph
+      The residual graph once no augmenting path is left
+    reachable : None
+      This engine does not track the vertices reachable from the source
+    """
     max_flow = 0  # Initialize max flow
 
+    if isinstance(graph, ResidualGraph):
+        residual_graph = graph.copy()  # Residual capacities only; topology is shared
+        cap, rev = residual_graph.cap, residual_graph.rev
+        visited = bytearray(residual_graph.n)  # Search buffers shared by all paths
+        parent = [0] * residual_graph.n
+
+        now = clock(stats)
+        augmenting_path = find_arc_path(residual_graph, source, target, visited, parent, stats, delta)
+        while augmenting_path:
+            now = lap(stats, 'path_search_seconds', now)
+            min_capacity = min(cap[a] for a in augmenting_path)
+            max_flow += min_capacity
+            for a in augmenting_path:
+                cap[a] -= min_capacity  # Reduce capacity on forward arc
+                cap[rev[a]] += min_capacity  # Increase capacity on its pair
+            augmented(stats, len(augmenting_path), min_capacity)
+            now = lap(stats, 'residual_update_seconds', now)
+            augmenting_path = find_arc_path(residual_graph, source, target, visited, parent, stats, delta)
+
+        lap(stats, 'path_search_seconds', now)
+        return max_flow, residual_graph, None
+
     residual_graph = copy.deepcopy(graph)  # Start with the same graph for residuals
+    visited = bytearray(len(graph))  # Search buffers shared by all paths
+    parent = [0] * len(graph)
 
-    augmenting_path = find_path(residual_graph, source, target, [])  # Find first path
+    now = clock(stats)  # Time the phases only when stats are collected
+    augmenting_path = find_path(residual_graph, source, target, [], visited, parent, stats, delta)  # Find first path
 
     while augmenting_path:  # While a path exists
+        now = lap(stats, 'path_search_seconds', now)
         # Find the minimum capacity in the augmenting path
         min_capacity = residual_graph[augmenting_path[0]][augmenting_path[1]]
         i = 1
@@ -413,12 +870,2345 @@ def ff_with_min_cut(graph, source, target):
             residual_graph[v][u] += min_capacity  # Increase capacity on backward edge
             i += 1
 
-        augmenting_path = find_path(residual_graph, source, target, [])  # Find new path
-
-    min_cut = find_min_cut(graph, residual_graph, source)  # Find the min cut
+        augmented(stats, len(augmenting_path) - 1, min_capacity)
+        now = lap(stats, 'residual_update_seconds', now)
+        augmenting_path = find_path(residual_graph, source, target, [], visited, parent, stats, delta)  # Find new path
+
+    lap(stats, 'path_search_seconds', now)
+    return max_flow, residual_graph, None
+
+def capacity_scaling(graph, source, target, stats=None):
+    """Capacity-scaling engine: augments along paths with a large bottleneck first.
+
+    Every phase only follows edges with at least delta residual capacity, so
+    every path it finds moves at least delta units of flow. delta starts at the
+    largest power of two no greater than the largest capacity, and is halved
+    after each phase; the last phase follows every edge with capacity left, as
+    ford_fulkerson does. A phase ends with less than 2 * delta * E flow left
+    to find, so there are O(E) augmentations per phase and O(E log U) in all,
+    for a largest capacity U. Takes and returns the same values as
+    ford_fulkerson, and also counts phases in stats.
+    """
+    if isinstance(graph, ResidualGraph):
+        largest = max(graph.capacity, default=0)
+    else:
+        largest = max((max(row) for row in graph), default=0)
+
+    delta = 1
+    while delta * 2 <= largest:
+        delta *= 2
+
+    max_flow = 0
+    residual_graph = graph  # Every phase works on a copy of the one before
+    while True:
+        if delta == 1:
+            delta = 0  # The last phase follows any edge with capacity left
+        tally(stats, phases=1)
+        flow, residual_graph, _ = ford_fulkerson(residual_graph, source, target, stats, delta)
+        max_flow += flow
+        if delta == 0:
+            return max_flow, residual_graph, None
+        delta //= 2
+
+def as_residual_graph(graph):
+    """Returns a fresh ResidualGraph for an adjacency matrix or a ResidualGraph."""
+    if isinstance(graph, ResidualGraph):
+        return graph.copy()
+    return ResidualGraph.from_matrix(graph)
+
+def graph_edges(graph):
+    """Yields the (u, v, capacity) edges of an adjacency matrix or ResidualGraph."""
+    if isinstance(graph, ResidualGraph):
+        yield from graph.edges()
+        return
+    if np is not None and isinstance(graph, np.ndarray):
+        graph = graph.tolist()
+    for u, row in enumerate(graph):
+        for v, c in enumerate(row):
+            if c > 0:
+                yield u, v, c
+
+def edmonds_karp(graph, source, target, stats=None):
+    """Edmonds-Karp engine: always augments along a shortest path.
+
+    Breadth-first search finds the augmenting path with the fewest arcs, which
+    bounds the number of augmentations by O(VE) whatever the capacities are,
+    for O(VE^2) time overall. Takes and returns the same values as
+    ford_fulkerson, except that the residual graph is always a ResidualGraph
+    and reachable lists the vertices reachable from the source at the end.
+    """
+    residual_graph = as_residual_graph(graph)
+    n = residual_graph.n
+    start, head, rev = residual_graph.start, residual_graph.head, residual_graph.rev
+    cap = residual_graph.cap
+    max_flow = 0
+    scanned = 0
+    now = clock(stats)
+
+    while True:
+        # Breadth-first search, remembering the arc used to reach each vertex
+        parent_arc = [-1] * n
+        visited = bytearray(n)
+        visited[source] = 1
+        queue = [source]
+        for u in queue:  # queue grows while we iterate over it
+            scanned += start[u + 1] - start[u]
+            for a in range(start[u], start[u + 1]):
+                v = head[a]
+                if cap[a] > 0 and not visited[v]:
+                    visited[v] = 1
+                    parent_arc[v] = a
+                    queue.append(v)
+            if visited[target]:
+                break
+        now = lap(stats, 'path_search_seconds', now)
+        if not visited[target]:
+            tally(stats, edges_scanned=scanned)
+            return max_flow, residual_graph, visited
+
+        # Walk back from the target to find the bottleneck, then augment
+        min_capacity = None
+        length = 0
+        v = target
+        while v != source:
+            a = parent_arc[v]
+            if min_capacity is None or cap[a] < min_capacity:
+                min_capacity = cap[a]
+            v = head[rev[a]]
+            length += 1
+        v = target
+        while v != source:
+            a = parent_arc[v]
+            cap[a] -= min_capacity
+            cap[rev[a]] += min_capacity
+            v = head[rev[a]]
+        max_flow += min_capacity
+        augmented(stats, length, min_capacity)
+        now = lap(stats, 'residual_update_seconds', now)
+
+def dinic(graph, source, target, stats=None):
+    """Dinic engine: blocking flows in the level graph.
+
+    Each phase labels vertices with their breadth-first distance from the
+    source and saturates every shortest augmenting path at once, using a
+    current-arc pointer per vertex so that no arc is retried after it failed.
+    The distance to the target grows every phase, so there are at most V
+    phases of O(VE) each. Takes and returns the same values as edmonds_karp,
+    and also counts phases in stats.
+    """
+    residual_graph = as_residual_graph(graph)
+    n = residual_graph.n
+    start, head, rev = residual_graph.start, residual_graph.head, residual_graph.rev
+    cap = residual_graph.cap
+    max_flow = 0
+    phases = scanned = 0
+    now = clock(stats)
+
+    while True:
+        # Level graph: breadth-first distances from the source. Vertices further
+        # away than the target cannot be on a shortest augmenting path.
+        level = [-1] * n
+        level[source] = 0
+        queue = [source]
+        for u in queue:
+            if level[target] >= 0 and level[u] >= level[target]:
+                break
+            scanned += start[u + 1] - start[u]
+            for a in range(start[u], start[u + 1]):
+                v = head[a]
+                if cap[a] > 0 and level[v] < 0:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        if level[target] < 0:
+            lap(stats, 'path_search_seconds', now)
+            tally(stats, phases=phases, edges_scanned=scanned)
+            return max_flow, residual_graph, [d >= 0 for d in level]
+        phases += 1
+
+        # Blocking flow: advance along admissible arcs, retreat from dead ends
+        current_arc = list(start)
+        path = []  # arcs from the source to u
+        u = source
+        while True:
+            if u == target:
+                now = lap(stats, 'path_search_seconds', now)
+                min_capacity = min(cap[a] for a in path)
+                max_flow += min_capacity
+                for a in path:
+                    cap[a] -= min_capacity
+                    cap[rev[a]] += min_capacity
+                augmented(stats, len(path), min_capacity)
+                now = lap(stats, 'residual_update_seconds', now)
+                # Resume from the tail of the first saturated arc
+                for i, a in enumerate(path):
+                    if cap[a] == 0:
+                        del path[i:]
+                        break
+                u = head[path[-1]] if path else source
+                continue
+
+            a = current_arc[u]
+            end = start[u + 1]
+            next_level = level[u] + 1
+            while a < end and (cap[a] <= 0 or level[head[a]] != next_level):
+                a += 1
+            scanned += a - current_arc[u] + 1
+            current_arc[u] = a
+            if a < end:
+                path.append(a)
+                u = head[a]
+            elif u == source:
+                break  # The level graph is blocked
+            else:
+                # u is a dead end for the rest of the phase
+                level[u] = -1
+                a = path.pop()
+                u = head[rev[a]]
+                current_arc[u] += 1
+
+def reaches_target(residual_graph, target):
+    """Flags the vertices that have a residual path to the target, found by a
+    breadth-first search that follows arcs backwards from the target."""
+    start, head, rev = residual_graph.start, residual_graph.head, residual_graph.rev
+    cap = residual_graph.cap
+    reaches = bytearray(residual_graph.n)
+    reaches[target] = 1
+    queue = [target]
+    for v in queue:
+        for a in range(start[v], start[v + 1]):
+            u = head[a]
+            if not reaches[u] and cap[rev[a]] > 0:  # u --> v has capacity left
+                reaches[u] = 1
+                queue.append(u)
+    return reaches
+
+def push_relabel(graph, source, target, flow=False, stats=None):
+    """Highest-label push-relabel engine with global relabeling and the gap
+    heuristic.
+
+    Instead of augmenting whole paths, push-relabel floods the network from the
+    source and moves excess flow one arc at a time towards vertices of lower
+    height, always discharging the highest active vertex first. Every n
+    relabels the heights are reset to exact distances to the target by a
+    backwards breadth-first search (global relabel), and when no vertex is left
+    at some height, all vertices above it are cut off from the target at once
+    (gap heuristic).
+
+    The first phase ends with a maximum preflow: the flow into the target is
+    the max flow, and the vertices that can no longer reach the target give the
+    min cut. Some vertices may still hold excess flow. The second phase, run
+    only when flow is True, returns that excess to the source so that the
+    residual graph describes a valid flow (see edge_flows).
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      adjacency matrix or sparse residual graph of the input graph
+    source, target : int
+      labels of the source and target vertices
+    flow : bool
+      whether to turn the maximum preflow into a maximum flow
+    stats : dict
+      optional counters: pushes, relabels, global_relabels and edges_scanned,
+      and the seconds spent discharging vertices and in global relabels. The
+      paths of the second phase count as augmentations.
+
+    Returns
+    -------
+    max_flow : int
+      The max flow that can travel from source to target in the input graph
+    residual_graph : ResidualGraph
+      The final residual graph, of a preflow unless flow is True
+    reachable : bytearray
+      Flags of the source side of the min cut: the vertices that cannot reach
+      the target in the residual graph of the maximum preflow
+    """
+    residual_graph = as_residual_graph(graph)
+    n = residual_graph.n
+    start, head, rev = residual_graph.start, residual_graph.head, residual_graph.rev
+    cap = residual_graph.cap
+
+    height = [0] * n
+    excess = [0] * n
+    current_arc = list(start)
+    counts = {'pushes': 0, 'relabels': 0, 'global_relabels': 0, 'edges_scanned': 0}
+    active = [[] for _ in range(n)]  # active vertices by height, below n
+    members = [set() for _ in range(n)]  # all vertices by height, below n
+    max_height = 0  # no vertex is above it, except those lifted to n
+
+    # Saturate every arc leaving the source
+    height[source] = n
+    for a in range(start[source], start[source + 1]):
+        if cap[a] > 0:
+            v = head[a]
+            excess[v] += cap[a]
+            excess[source] -= cap[a]
+            cap[rev[a]] += cap[a]
+            cap[a] = 0
+
+    def global_relabel():
+        # Exact distances to the target; vertices that cannot reach it are
+        # lifted to n and take no further part in the first phase
+        nonlocal max_height
+        for h in range(max_height + 1):
+            active[h].clear()
+            members[h].clear()
+        for v in range(n):
+            height[v] = n
+            current_arc[v] = start[v]
+        height[target] = 0
+        queue = [target]
+        for v in queue:
+            counts['edges_scanned'] += start[v + 1] - start[v]
+            for a in range(start[v], start[v + 1]):
+                u = head[a]
+                if height[u] == n and u != source and cap[rev[a]] > 0:
+                    height[u] = height[v] + 1
+                    queue.append(u)
+        highest = 0
+        for v in queue:
+            members[height[v]].add(v)
+            if excess[v] > 0 and v != target:
+                active[height[v]].append(v)
+                highest = height[v]
+        max_height = height[queue[-1]]  # the queue is in order of height
+        counts['global_relabels'] += 1
+        return highest
+
+    now = clock(stats)
+    highest = global_relabel()
+    now = lap(stats, 'global_relabel_seconds', now)
+    relabels = 0
+    while highest > 0:
+        if not active[highest]:
+            highest -= 1
+            continue
+        u = active[highest].pop()
+        if height[u] != highest or excess[u] <= 0:
+            continue  # stale entry left behind by a gap
+
+        # Discharge u: push along admissible arcs, relabel when there are none
+        end = start[u + 1]
+        while excess[u] > 0:
+            a = current_arc[u]
+            if a == end:
+                old_height = height[u]
+                new_height = 2 * n
+                for b in range(start[u], end):
+                    if cap[b] > 0 and height[head[b]] + 1 < new_height:
+                        new_height = height[head[b]] + 1
+                members[old_height].discard(u)
+                current_arc[u] = start[u]
+                relabels += 1
+                counts['relabels'] += 1
+                counts['edges_scanned'] += end - start[u]
+                if not members[old_height]:
+                    # Gap: nothing at old_height, so nothing above it can reach
+                    # the target any more. Only the heights up to max_height
+                    # hold vertices, so the gap costs no more than they do.
+                    for h in range(old_height + 1, max_height + 1):
+                        for v in members[h]:
+                            height[v] = n
+                        members[h].clear()
+                        active[h].clear()
+                    max_height = old_height - 1
+                    highest = min(highest, max_height)
+                    new_height = n
+                height[u] = min(new_height, n)
+                if height[u] >= n:
+                    break
+                members[height[u]].add(u)
+                max_height = max(max_height, height[u])
+                continue
+            v = head[a]
+            if cap[a] > 0 and height[u] == height[v] + 1:
+                delta = min(excess[u], cap[a])
+                cap[a] -= delta
+                cap[rev[a]] += delta
+                excess[u] -= delta
+                counts['pushes'] += 1
+                if excess[v] == 0 and v != target:
+                    active[height[v]].append(v)
+                    highest = max(highest, height[v])
+                excess[v] += delta
+            else:
+                current_arc[u] = a + 1
+                counts['edges_scanned'] += 1
+
+        if relabels >= n:
+            relabels = 0
+            now = lap(stats, 'discharge_seconds', now)
+            highest = global_relabel()
+            now = lap(stats, 'global_relabel_seconds', now)
+
+    now = lap(stats, 'discharge_seconds', now)
+    max_flow = excess[target]
+    reachable = bytearray(1 - r for r in reaches_target(residual_graph, target))
+
+    if flow:
+        # Second phase: send the excess left inside the network back to the
+        # source along residual paths
+        visited = bytearray(n)
+        parent = [0] * n
+        for v in range(n):
+            while excess[v] > 0 and v != source and v != target:
+                path = find_arc_path(residual_graph, v, source, visited, parent, stats)
+                delta = min([excess[v]] + [cap[a] for a in path])
+                for a in path:
+                    cap[a] -= delta
+                    cap[rev[a]] += delta
+                excess[v] -= delta
+                augmented(stats, len(path), delta)
+        lap(stats, 'return_excess_seconds', now)
+
+    tally(stats, **counts)
+    return max_flow, residual_graph, reachable
+
+def edge_flows(residual_graph):
+    """Lists the (u, v, flow) edges that carry flow in a sparse residual graph.
+
+    The flow on an edge is its input capacity minus its residual capacity.
+    """
+    start, head = residual_graph.start, residual_graph.head
+    capacity, cap = residual_graph.capacity, residual_graph.cap
+    flows = []
+    for u in range(residual_graph.n):
+        for a in range(start[u], start[u + 1]):
+            if capacity[a] > 0 and cap[a] < capacity[a]:
+                flows.append((u, head[a], capacity[a] - cap[a]))
+    return flows
+
+def bfs_frontier(residual_graph, source, target=None, stats=None):
+    """Breadth-first search of a NumPy residual graph, a frontier at a time.
+
+    Every vertex of the frontier is expanded at once: the rows of the frontier
+    are compared with 0 in a single operation, and the unvisited columns with a
+    positive entry form the next frontier. The search stops early once the
+    target, if given, is reached.
+
+    Returns
+    -------
+    visited : ndarray
+      boolean flags of the vertices reached from the source
+    parent : ndarray
+      for every reached vertex, the vertex it was reached from; -1 otherwise
+    """
+    n = residual_graph.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    parent = np.full(n, -1)
+    visited[source] = True
+    frontier = np.array([source])
+    scanned = 0
+    while frontier.size and not (target is not None and visited[target]):
+        scanned += frontier.size * n
+        edges = (residual_graph[frontier] > 0) & ~visited  # frontier x n
+        found = edges.any(axis=0)
+        nodes = np.flatnonzero(found)
+        # The first frontier vertex with an edge to each new vertex is its parent
+        parent[nodes] = frontier[edges[:, nodes].argmax(axis=0)]
+        visited[nodes] = True
+        frontier = nodes
+    tally(stats, edges_scanned=scanned)
+    return visited, parent
+
+def dense_numpy(graph, source, target, stats=None):
+    """NumPy engine for dense adjacency matrices.
+
+    The residual graph is an ndarray; shortest augmenting paths are found with
+    bfs_frontier, and their bottleneck and residual updates use fancy indexing
+    along the whole path. The graph may be the list of lists used elsewhere in
+    this module, or an ndarray, which is used as is for the input capacities
+    and copied once for the residual graph. Takes and returns the same values
+    as edmonds_karp, with ndarrays for the residual graph and reachable.
+    """
+    if np is None:
+        raise ImportError("the 'numpy' engine requires NumPy")
+    if isinstance(graph, ResidualGraph):
+        raise TypeError("the 'numpy' engine needs an adjacency matrix")
+    capacity = np.asarray(graph)
+    residual_graph = capacity.copy()
+    max_flow = 0
+    now = clock(stats)
+
+    while True:
+        reachable, parent = bfs_frontier(residual_graph, source, target, stats)
+        now = lap(stats, 'path_search_seconds', now)
+        if not reachable[target]:
+            return max_flow, residual_graph, reachable
+
+        path = [target]
+        while path[-1] != source:
+            path.append(parent[path[-1]])
+        path.reverse()
+        tails, heads = path[:-1], path[1:]
+
+        min_capacity = residual_graph[tails, heads].min()
+        residual_graph[tails, heads] -= min_capacity  # Forward edges
+        residual_graph[heads, tails] += min_capacity  # Back-edges
+        max_flow += min_capacity.item()
+        augmented(stats, len(tails), min_capacity.item())
+        now = lap(stats, 'residual_update_seconds', now)
+
+def unit_bipartite(graph, source, target):
+    """Recognizes a bipartite matching problem written as a flow network.
+
+    That is a graph whose edges all have capacity 1 and either leave the
+    source for a left vertex, join a left vertex to a right vertex, or join a
+    right vertex to the target, without parallel edges.
+
+    Returns
+    -------
+    structure : tuple
+      (left, right, pairs): the left and right vertices, and the (u, v) edges
+      between them; None if the graph is not such a network
+    """
+    left, right, pairs = set(), set(), []
+    for u, v, c in graph_edges(graph):
+        if c != 1:
+            return None
+        if u == source:
+            if v in left or v == target:
+                return None
+            left.add(v)
+        elif v == target:
+            if u in right:
+                return None
+            right.add(u)
+        else:
+            pairs.append((u, v))
+    if not left or not right or left & right or source in right or target in left:
+        return None
+    for u, v in pairs:
+        if u not in left or v not in right:
+            return None
+    if len(set(pairs)) != len(pairs):
+        return None
+    return sorted(left), sorted(right), pairs
+
+def hopcroft_karp(graph, source, target, stats=None, structure=None):
+    """Hopcroft-Karp engine for unit-capacity bipartite matching networks.
+
+    The max flow of a network recognized by unit_bipartite is the size of a
+    maximum matching between its left and right vertices. Each phase finds
+    the shortest augmenting paths of the matching by a breadth-first search
+    from the unmatched left vertices, then augments along a maximal set of
+    disjoint ones by depth-first search, in O(E) time. O(sqrt(V)) phases are
+    enough, for O(E sqrt(V)) time instead of the O(VE) of one augmenting path
+    per matched pair.
+
+    The min cut comes from Konig's theorem: the vertices reachable from the
+    unmatched left vertices along alternating paths (unmatched edges to the
+    right, matched edges back to the left) are, with the source, those the
+    source reaches in the residual graph of the matching. The left vertices
+    not reached and the right vertices reached form a minimum vertex cover,
+    whose source and target edges are the min cut.
+
+    Takes and returns the same values as edmonds_karp, and also counts phases
+    in stats; structure is the result of unit_bipartite, if already known.
+    Raises ValueError for other networks.
+    """
+    if structure is None:
+        structure = unit_bipartite(graph, source, target)
+    if structure is None:
+        raise ValueError("the 'hopcroft-karp' engine needs a unit-capacity "
+                         "bipartite network between the source and the target")
+    left, right, pairs = structure
+    left_index = {u: i for i, u in enumerate(left)}
+    right_index = {v: j for j, v in enumerate(right)}
+    adjacent = [[] for _ in left]
+    for u, v in pairs:
+        adjacent[left_index[u]].append(right_index[v])
+
+    match_left = [-1] * len(left)
+    match_right = [-1] * len(right)
+    phases = scanned = 0
+    now = clock(stats)
+    while True:
+        # Distances from the unmatched left vertices along alternating paths,
+        # up to the first layer with an edge to an unmatched right vertex
+        distance = [-1] * len(left)
+        queue = [i for i, j in enumerate(match_left) if j < 0]
+        for i in queue:
+            distance[i] = 0
+        shortest = -1  # layer of the shortest augmenting paths
+        for i in queue:
+            if shortest >= 0 and distance[i] > shortest:
+                break
+            scanned += len(adjacent[i])
+            for j in adjacent[i]:
+                k = match_right[j]
+                if k < 0:
+                    shortest = distance[i]
+                elif distance[k] < 0:
+                    distance[k] = distance[i] + 1
+                    queue.append(k)
+        now = lap(stats, 'path_search_seconds', now)
+        if shortest < 0:
+            break
+        phases += 1
+
+        # Vertex-disjoint shortest augmenting paths, each found by a
+        # depth-first search along the layers, with a current-arc pointer per
+        # vertex, that only ends at an unmatched right vertex from the last
+        # layer
+        current_arc = [0] * len(left)
+        for root in range(len(left)):
+            if match_left[root] >= 0:
+                continue
+            stack, via = [root], []
+            while stack:
+                i = stack[-1]
+                if current_arc[i] == len(adjacent[i]):
+                    distance[i] = -1  # dead end for the rest of the phase
+                    stack.pop()
+                    if via:
+                        via.pop()
+                    continue
+                j = adjacent[i][current_arc[i]]
+                current_arc[i] += 1
+                scanned += 1
+                k = match_right[j]
+                if k < 0 and distance[i] == shortest:
+                    # Flip the path: every left vertex on it takes the next
+                    # right vertex
+                    via.append(j)
+                    for k, j in zip(stack, via):
+                        match_left[k] = j
+                        match_right[j] = k
+                        distance[k] = -1  # keeps the paths of a phase disjoint
+                    augmented(stats, 2 * len(stack) + 1, 1)
+                    break
+                if k >= 0 and distance[k] == distance[i] + 1 and distance[k] <= shortest:
+                    via.append(j)
+                    stack.append(k)
+        now = lap(stats, 'residual_update_seconds', now)
+    tally(stats, phases=phases, edges_scanned=scanned)
+
+    # Residual graph of the flow of the matching
+    residual_graph = as_residual_graph(graph)
+    start, head, rev = residual_graph.start, residual_graph.head, residual_graph.rev
+    cap = residual_graph.cap
+
+    def push(u, v):
+        a = bisect.bisect_left(head, v, start[u], start[u + 1])
+        cap[a] -= 1
+        cap[rev[a]] += 1
+
+    max_flow = 0
+    for i, j in enumerate(match_left):
+        if j >= 0:
+            push(source, left[i])
+            push(left[i], right[j])
+            push(right[j], target)
+            max_flow += 1
+
+    # Alternating paths from the unmatched left vertices (Konig's theorem)
+    reached_left = bytearray(len(left))
+    reached_right = bytearray(len(right))
+    queue = [i for i, j in enumerate(match_left) if j < 0]
+    for i in queue:
+        reached_left[i] = 1
+    for i in queue:
+        for j in adjacent[i]:
+            if j != match_left[i] and not reached_right[j]:
+                reached_right[j] = 1
+                k = match_right[j]  # matched, or the matching would grow
+                if not reached_left[k]:
+                    reached_left[k] = 1
+                    queue.append(k)
+    reachable = bytearray(residual_graph.n)
+    reachable[source] = 1
+    for i, u in enumerate(left):
+        reachable[u] = reached_left[i]
+    for j, v in enumerate(right):
+        reachable[v] = reached_right[j]
+    return max_flow, residual_graph, reachable
+
+def auto(graph, source, target, stats=None):
+    """Default engine: hopcroft_karp for the networks that unit_bipartite
+    recognizes, ford_fulkerson for all others."""
+    structure = unit_bipartite(graph, source, target)
+    if structure is not None:
+        return hopcroft_karp(graph, source, target, stats, structure)
+    return ford_fulkerson(graph, source, target, stats)
+
+# Max-flow engines, by the name passed as algorithm= to ff_with_min_cut
+ENGINES = {
+    'ford-fulkerson': ford_fulkerson,
+    'edmonds-karp': edmonds_karp,
+    'dinic': dinic,
+    'push-relabel': push_relabel,
+    'numpy': dense_numpy,
+    'capacity-scaling': capacity_scaling,
+    'hopcroft-karp': hopcroft_karp,
+    'auto': auto,
+}
+
+def solve(graph, source, target, algorithm='auto', stats=None):
+    """Runs one of the ENGINES on a flow network.
+
+    Inputs
+    ------
+    graph : list, ResidualGraph or ndarray
+      adjacency matrix or sparse residual graph of the input graph; ndarrays
+      are for the 'numpy' engine
+    source, target : int
+      labels of the source and target vertices
+    algorithm : str
+      'ford-fulkerson' (depth-first augmenting paths), 'edmonds-karp'
+      (shortest augmenting paths), 'dinic' (blocking flows), 'push-relabel'
+      (maximum preflow; the residual graph then holds a preflow), 'numpy'
+      (vectorized shortest augmenting paths on a dense matrix) or
+      'capacity-scaling' (augmenting paths with a bottleneck of at least delta,
+      for halving values of delta), 'hopcroft-karp' (maximum matching, for
+      unit-capacity bipartite networks only) or 'auto', the default, which
+      runs 'hopcroft-karp' on the networks it suits and 'ford-fulkerson' on
+      all others
+    stats : dict
+      optional dict of counters that the engine adds to, such as augmentations
+      and edges_scanned, and of seconds spent in each phase; a SolverStats
+      also records every augmenting path and can report progress
+
+    Returns
+    -------
+    max_flow : int
+      The max flow that can travel from source to target in the input graph
+    residual_graph : list or ResidualGraph
+      The final residual graph; the input graph is left untouched
+    reachable : list
+      Vertices reachable from the source in the final residual graph, as a list
+      of flags, or None if the engine did not track them
+    """
+    if algorithm not in ENGINES:
+        raise ValueError("unknown algorithm %r; expected one of %s"
+                         % (algorithm, ", ".join(sorted(ENGINES))))
+    return ENGINES[algorithm](graph, source, target, stats=stats)
+
+def ff_with_min_cut(graph, source, target, algorithm='auto', stats=None,
+                    reduce=False):
+    """Finds max flow and minimum cut in a flow network.
+
+    The graph is either an adjacency matrix or a ResidualGraph, e.g.
+    ResidualGraph([(0, 1, 20), (1, 2, 5), ...]) for an edge list. The algorithm
+    picks one of the ENGINES; 'edmonds-karp' and 'dinic' have running times
+    that do not depend on the capacities, and 'capacity-scaling' needs few
+    augmentations even when they are huge. The default, 'auto', solves
+    unit-capacity bipartite matching networks with 'hopcroft-karp' and other
+    networks with 'ford-fulkerson'. Pass a dict or a SolverStats as
+    stats to collect the engine's counters and timers, and the seconds spent
+    finding the min cut (cut_seconds).
+
+    With reduce=True, the graph is first shrunk by GraphReduction, and the
+    solve runs on the reduced graph. The min cut is still reported as edges of
+    the input graph, and stats also get the sizes in GraphReduction.report and
+    the seconds spent reducing (reduce_seconds). Unit-capacity bipartite
+    networks are solved as they are: collapsing and merging their edges would
+    hide the matching structure that 'hopcroft-karp' needs.
+    """
+    if reduce and algorithm in ('auto', 'hopcroft-karp'):
+        reduce = algorithm == 'auto' and unit_bipartite(graph, source, target) is None
+    if reduce:
+        now = clock(stats)
+        reduction = GraphReduction(graph, source, target)
+        lap(stats, 'reduce_seconds', now)
+        tally(stats, **reduction.report)
+        reduced_graph = reduction.matrix() if algorithm == 'numpy' else reduction.graph
+        max_flow, min_cut = ff_with_min_cut(reduced_graph, reduction.source,
+                                            reduction.target, algorithm, stats)
+        return max_flow, reduction.original_cut(min_cut)
+
+    max_flow, residual_graph, reachable = solve(graph, source, target, algorithm, stats)
+
+    now = clock(stats)
+    min_cut = find_min_cut(graph, residual_graph, source, reachable)  # Find the min cut
+    lap(stats, 'cut_seconds', now)
 
     return max_flow, min_cut  # Return max flow and min cut
 
+class GraphReduction:
+    """A smaller network with the same max flow, and the way back to the input.
+
+    Three reductions are applied before solving:
+    - vertices that are not both reachable from the source and able to reach
+      the target can carry no flow from the source to the target, and are
+      removed with their edges;
+    - parallel edges are merged into one edge with their total capacity;
+    - a vertex other than the source and the target whose edges all lead to or
+      come from the same two neighbours u and v only passes flow between them,
+      so it is replaced by an edge u --> v whose capacity is the smaller one of
+      u --> w and w --> v (and likewise v --> u). This is repeated, so a whole
+      chain of such vertices collapses into one edge.
+
+    Every edge of the reduced graph remembers the input edges that it stands
+    for: all of them for merged edges, and those of the smaller side for a
+    collapsed chain. Those edges have the same total capacity as the reduced
+    edge, and removing them cuts it, so a min cut of the reduced graph maps to
+    a min cut of the input graph.
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      adjacency matrix or sparse residual graph of the input graph
+    source, target : int
+      labels of the source and target vertices
+
+    Attributes
+    ----------
+    graph : ResidualGraph
+      the reduced graph
+    source, target : int
+      labels of the source and target in the reduced graph
+    vertices : list
+      for every vertex of the reduced graph, its label in the input graph
+    report : dict
+      vertices and edges of the input graph, reduced_vertices and
+      reduced_edges of the reduced one, and how many vertices were pruned
+      (pruned_vertices) or collapsed (collapsed_vertices), and edges merged
+      into parallel ones (merged_edges)
+    """
+
+    def __init__(self, graph, source, target):
+        n = graph.n if isinstance(graph, ResidualGraph) else len(graph)
+        edges = list(graph_edges(graph))
+
+        # Keep the vertices on some path from the source to the target
+        successors = [[] for _ in range(n)]
+        predecessors = [[] for _ in range(n)]
+        for u, v, c in edges:
+            successors[u].append(v)
+            predecessors[v].append(u)
+        forward = self._reach(successors, source)
+        backward = self._reach(predecessors, target)
+        keep = bytearray(f & b for f, b in zip(forward, backward))
+        keep[source] = keep[target] = 1
+        pruned = n - sum(keep)
+
+        # Merge parallel edges: out[u][v] and into[v][u] are the same bundle,
+        # [capacity, input edges]
+        self._out = out = [{} for _ in range(n)]
+        self._into = into = [{} for _ in range(n)]
+        self._merged = 0
+        for u, v, c in edges:
+            if u != v and keep[u] and keep[v]:
+                self._link(u, v, c, [(u, v)])
+
+        # Collapse the vertices that only pass flow between two neighbours
+        collapsed = 0
+        candidates = [w for w in range(n) if keep[w]]
+        while candidates:
+            w = candidates.pop()
+            if w == source or w == target or not keep[w]:
+                continue
+            neighbours = set(out[w]) | set(into[w])
+            if len(neighbours) != 2:
+                continue
+            u, v = neighbours
+            for a, b in ((u, v), (v, u)):
+                if a in into[w] and b in out[w]:
+                    first, second = into[w][a], out[w][b]
+                    self._link(a, b, *min(first, second, key=lambda bundle: bundle[0]))
+            for x in out[w]:
+                del into[x][w]
+            for x in into[w]:
+                del out[x][w]
+            out[w] = {}
+            into[w] = {}
+            keep[w] = 0
+            collapsed += 1
+            candidates += [u, v]
+
+        # Number the remaining vertices from 0
+        self.vertices = [v for v in range(n) if keep[v]]
+        index = {v: i for i, v in enumerate(self.vertices)}
+        self._bundles = {}
+        reduced_edges = []
+        for u in self.vertices:
+            for v, (c, originals) in out[u].items():
+                reduced_edges.append((index[u], index[v], c))
+                self._bundles[index[u], index[v]] = originals
+        self.graph = ResidualGraph(reduced_edges, len(self.vertices))
+        self.source, self.target = index[source], index[target]
+        self.report = {
+            'vertices': n,
+            'edges': len(edges),
+            'reduced_vertices': len(self.vertices),
+            'reduced_edges': len(reduced_edges),
+            'pruned_vertices': pruned,
+            'collapsed_vertices': collapsed,
+            'merged_edges': self._merged,
+        }
+        del self._out, self._into
+
+    @staticmethod
+    def _reach(neighbours, start):
+        """Flags the vertices reachable from start in an adjacency list."""
+        reached = bytearray(len(neighbours))
+        reached[start] = 1
+        stack = [start]
+        while stack:
+            for v in neighbours[stack.pop()]:
+                if not reached[v]:
+                    reached[v] = 1
+                    stack.append(v)
+        return reached
+
+    def _link(self, u, v, capacity, originals):
+        """Adds an edge u --> v standing for the input edges originals,
+        merging it with the edge u --> v if there is one already."""
+        bundle = self._out[u].get(v)
+        if bundle is None:
+            self._out[u][v] = self._into[v][u] = [capacity, list(originals)]
+        else:
+            bundle[0] += capacity
+            bundle[1].extend(originals)
+            self._merged += 1
+
+    def matrix(self):
+        """Returns the reduced graph as an adjacency matrix."""
+        n = len(self.vertices)
+        matrix = [[0] * n for _ in range(n)]
+        for u, v, c in self.graph.edges():
+            matrix[u][v] += c
+        return matrix
+
+    def original_cut(self, min_cut):
+        """Maps the (u, v) edges of a cut of the reduced graph to the edges of
+        the input graph that they stand for."""
+        return [edge for u, v in min_cut for edge in self._bundles[u, v]]
+
+class MinCutEnumerator:
+    """All the minimum cuts of a network, from a single max-flow computation.
+
+    In the residual graph of a maximum flow, the source side S of a min cut is
+    exactly a set of vertices that contains the source but not the target, and
+    that no residual arc leaves (Picard and Queyranne). Vertices on a residual
+    cycle are therefore always on the same side, so the residual graph is
+    condensed into its strongly connected components by Tarjan's algorithm, in
+    one linear pass. Every min cut is then a choice of components closed under
+    the arcs of the condensation.
+
+    Only the saturated edges between two components can be cut, and since a
+    saturated edge carries flow, every component they touch lies on a path of
+    the flow from the source to the target, where the source side is a prefix:
+    given the cut edges, the side of each of those components follows. The
+    side of the other components never changes the cut. So cuts() enumerates
+    the cuts lazily by choosing a side for the components with saturated edges
+    only: each one is put on the source side together with all its
+    successors, or on the target side together with all its predecessors.
+    Every such choice leads to a cut, and different choices to different
+    cuts, so no time is spent on dead ends or duplicates.
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      adjacency matrix or sparse residual graph of the input graph
+    source, target : int
+      labels of the source and target vertices
+    algorithm : str
+      one of the ENGINES except 'numpy'; 'push-relabel' is run with flow=True,
+      since a maximum preflow does not give every min cut
+
+    Attributes
+    ----------
+    max_flow : int
+      capacity of every min cut
+    component : list
+      for every vertex, the index of its strongly connected component in the
+      residual graph; components only have residual arcs to lower indices
+    """
+
+    def __init__(self, graph, source, target, algorithm='dinic'):
+        if not isinstance(graph, ResidualGraph):
+            graph = ResidualGraph.from_matrix(graph)
+        if algorithm == 'push-relabel':
+            self.max_flow, residual_graph, _ = push_relabel(graph, source, target, flow=True)
+        else:
+            self.max_flow, residual_graph, _ = solve(graph, source, target, algorithm)
+        self.residual_graph = residual_graph
+        self.source, self.target = source, target
+        self.component = self._components(residual_graph)
+
+        # Arcs of the condensation, both ways
+        count = max(self.component) + 1 if self.component else 0
+        successors = [set() for _ in range(count)]
+        predecessors = [set() for _ in range(count)]
+        start, head, cap = residual_graph.start, residual_graph.head, residual_graph.cap
+        for u in range(residual_graph.n):
+            for a in range(start[u], start[u + 1]):
+                if cap[a] > 0:
+                    cu, cv = self.component[u], self.component[head[a]]
+                    if cu != cv:
+                        successors[cu].add(cv)
+                        predecessors[cv].add(cu)
+        self._successors, self._predecessors = successors, predecessors
+
+        # Components whose side can change the cut: the ends of saturated
+        # edges, counted by pair of components
+        capacity = residual_graph.capacity
+        cutting = bytearray(count)
+        self._saturated = saturated = {}
+        for u in range(residual_graph.n):
+            for a in range(start[u], start[u + 1]):
+                if capacity[a] > 0 and cap[a] <= 0:
+                    cu, cv = self.component[u], self.component[head[a]]
+                    if cu != cv:
+                        cutting[cu] = cutting[cv] = 1
+                        saturated[cu, cv] = saturated.get((cu, cv), 0) + 1
+        self._cutting = [c for c in range(count) if cutting[c]]
+
+        # Components reachable from the source are always on its side, and
+        # those that reach the target never are; the others are free
+        self._sides = bytearray(count)  # 0: free, 1: source side, 2: target side
+        self._place(self._sides, self.component[source], 1, successors)
+        self._place(self._sides, self.component[target], 2, predecessors)
+
+    @staticmethod
+    def _components(residual_graph):
+        """Labels the strongly connected components of the residual arcs by
+        Tarjan's algorithm, with an explicit stack instead of recursion."""
+        n = residual_graph.n
+        start, head, cap = residual_graph.start, residual_graph.head, residual_graph.cap
+        index = [-1] * n
+        low = [0] * n
+        on_stack = bytearray(n)
+        stack = []
+        component = [-1] * n
+        counter = count = 0
+        for root in range(n):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, start[root])]  # vertices being explored, next arc
+            while work:
+                u, a = work[-1]
+                end = start[u + 1]
+                while a < end:
+                    v = head[a]
+                    if cap[a] > 0:
+                        if index[v] < 0:
+                            break
+                        if on_stack[v] and index[v] < low[u]:
+                            low[u] = index[v]
+                    a += 1
+                if a < end:
+                    # Descend into v, coming back to the next arc of u later
+                    work[-1] = (u, a + 1)
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    on_stack[v] = 1
+                    work.append((v, start[v]))
+                    continue
+                work.pop()
+                if work and low[u] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[u]
+                if low[u] == index[u]:
+                    # u is the root of a component: everything above it on the stack
+                    while True:
+                        v = stack.pop()
+                        on_stack[v] = 0
+                        component[v] = count
+                        if v == u:
+                            break
+                    count += 1
+        return component
+
+    @staticmethod
+    def _place(sides, c, side, neighbours):
+        """Puts component c and, through neighbours, everything it forces on
+        the given side."""
+        sides[c] = side
+        stack = [c]
+        while stack:
+            for d in neighbours[stack.pop()]:
+                if not sides[d]:
+                    sides[d] = side
+                    stack.append(d)
+
+    def _cut(self, sides):
+        """Returns the cut edges of a choice of sides for every component."""
+        reachable = [sides[c] == 1 for c in self.component]
+        return find_min_cut(self.residual_graph, self.residual_graph, self.source, reachable)
+
+    def cuts(self, limit=None):
+        """Yields the min cuts one by one, each once, as lists of (u, v) edges,
+        starting with the source-side cut that ff_with_min_cut finds. At most
+        limit cuts are yielded, if given; there can be exponentially many."""
+        found = 0
+        pending = [self._sides]
+        while pending and (limit is None or found < limit):
+            sides = pending.pop()
+            # The first free component whose side matters; the components
+            # left free once there is none go to the target side
+            c = next((c for c in self._cutting if not sides[c]), None)
+            if c is None:
+                found += 1
+                yield self._cut(bytes(side or 2 for side in sides))
+                continue
+            for side, neighbours in ((1, self._successors), (2, self._predecessors)):
+                choice = bytearray(sides)
+                self._place(choice, c, side, neighbours)
+                pending.append(choice)
+
+    def source_side_cut(self):
+        """The min cut closest to the source: its source side is the set of
+        vertices reachable from the source."""
+        return self._cut(bytes(side or 2 for side in self._sides))
+
+    def sink_side_cut(self):
+        """The min cut closest to the target: its source side is every vertex
+        that cannot reach the target."""
+        return self._cut(bytes(side or 1 for side in self._sides))
+
+    def fewest_edges_cut(self):
+        """The min cut with the fewest edges, without enumerating the cuts.
+
+        A min cut is a source side closed under the arcs of the condensation,
+        and its edges are the saturated edges that leave it. So this is a
+        smaller cut problem on the components: every saturated edge between
+        two components becomes an edge of capacity 1, and every arc of the
+        condensation an edge that no cut of fewer edges can afford to cross.
+        One max flow on that network gives the source side."""
+        count = len(self._successors)
+        uncuttable = sum(self._saturated.values()) + 1
+        edges = [(cu, cv, k) for (cu, cv), k in self._saturated.items()]
+        edges += [(cu, cv, uncuttable)
+                  for cu in range(count) for cv in self._successors[cu]]
+        source, target = self.component[self.source], self.component[self.target]
+        _, residual_graph, reachable = dinic(ResidualGraph(edges, count), source, target)
+        if reachable is None:
+            reachable = bfs_reachable_nodes(residual_graph, source)
+        return self._cut(bytes(1 if reachable[c] else 2 for c in range(count)))
+
+class AnytimeMaxFlow:
+    """A max-flow computation that can be run in slices and stopped at any time.
+
+    Every call to run() augments along shortest paths, as edmonds_karp does,
+    until the max flow is found or the time or augmentation budget runs out,
+    and returns bounds on the max flow. The flow found so far is a lower
+    bound. Every cut is an upper bound, so after each run the breadth-first
+    levels of the residual graph are searched for the cut S_k = {vertices at
+    distance <= k from the source} of least capacity: that is the flow so far
+    plus the residual capacity of the arcs from level k to level k+1. The
+    bounds only get tighter, and the computation is done when they meet. The
+    residual graph is kept between runs, so a run resumes where the last one
+    stopped.
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      adjacency matrix or sparse residual graph of the input graph
+    source, target : int
+      labels of the source and target vertices
+    stats : dict
+      optional counters, as in solve
+
+    Attributes
+    ----------
+    lower, upper : int
+      the best bounds on the max flow so far
+    done : bool
+      whether lower is the max flow
+    """
+
+    def __init__(self, graph, source, target, stats=None):
+        self.residual_graph = as_residual_graph(graph)
+        self.source, self.target = source, target
+        self.stats = stats
+        start, cap = self.residual_graph.start, self.residual_graph.cap
+        self.lower = 0
+        self.upper = sum(cap[start[source]:start[source + 1]])  # the cut {source}
+        self._side = bytearray(self.residual_graph.n)
+        self._side[source] = 1
+        self.done = self.upper == 0
+        self._lock = threading.Lock()
+
+    def _levels(self, full):
+        """Breadth-first distances from the source in the residual graph, and
+        the arc that reached each vertex; stops at the target unless full."""
+        residual_graph = self.residual_graph
+        start, head, cap = residual_graph.start, residual_graph.head, residual_graph.cap
+        level = [-1] * residual_graph.n
+        parent_arc = [-1] * residual_graph.n
+        level[self.source] = 0
+        queue = [self.source]
+        scanned = 0
+        for u in queue:
+            scanned += start[u + 1] - start[u]
+            for a in range(start[u], start[u + 1]):
+                v = head[a]
+                if cap[a] > 0 and level[v] < 0:
+                    level[v] = level[u] + 1
+                    parent_arc[v] = a
+                    queue.append(v)
+            if not full and level[self.target] >= 0:
+                break
+        tally(self.stats, edges_scanned=scanned)
+        return level, parent_arc
+
+    def _finish(self, level):
+        """Records that no augmenting path is left: the vertices the source
+        reaches are the source side of a min cut."""
+        self.upper = self.lower
+        self._side = bytearray(d >= 0 for d in level)
+        self.done = True
+
+    def _tighten(self):
+        """Lowers the upper bound to the capacity of the best level cut."""
+        level, _ = self._levels(full=True)
+        last = level[self.target]
+        if last < 0:
+            self._finish(level)
+            return
+        residual_graph = self.residual_graph
+        start, head, cap = residual_graph.start, residual_graph.head, residual_graph.cap
+        crossing = [0] * last  # residual capacity from level k to level k + 1
+        for u in range(residual_graph.n):
+            k = level[u]
+            if 0 <= k < last:
+                for a in range(start[u], start[u + 1]):
+                    if cap[a] > 0 and level[head[a]] == k + 1:
+                        crossing[k] += cap[a]
+        k = min(range(last), key=crossing.__getitem__)
+        if self.lower + crossing[k] < self.upper:
+            self.upper = self.lower + crossing[k]
+            self._side = bytearray(0 <= d <= k for d in level)
+        if self.upper == self.lower:
+            self.done = True
+
+    def run(self, seconds=None, augmentations=None, tighten=True):
+        """Augments until the max flow is found, seconds have passed or
+        augmentations paths were used, whichever comes first, then returns
+        the bounds (lower, upper). Without a budget, runs to the end. With
+        tighten=False, the search for a better upper bound, which takes as
+        long as one augmentation, is skipped."""
+        with self._lock:
+            deadline = None if seconds is None else time.perf_counter() + seconds
+            residual_graph = self.residual_graph
+            head, rev, cap = residual_graph.head, residual_graph.rev, residual_graph.cap
+            count = 0
+            while not self.done:
+                if augmentations is not None and count >= augmentations:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                level, parent_arc = self._levels(full=False)
+                if level[self.target] < 0:
+                    self._finish(level)
+                    break
+
+                path = []
+                v = self.target
+                while v != self.source:
+                    path.append(parent_arc[v])
+                    v = head[rev[parent_arc[v]]]
+                min_capacity = min(cap[a] for a in path)
+                for a in path:
+                    cap[a] -= min_capacity
+                    cap[rev[a]] += min_capacity
+                self.lower += min_capacity
+                augmented(self.stats, len(path), min_capacity)
+                count += 1
+
+            if tighten and not self.done:
+                self._tighten()
+            return self.lower, self.upper
+
+    async def run_async(self, seconds=None, slice_seconds=0.05, executor=None):
+        """Runs the computation off the event loop, in slices of at most
+        slice_seconds on the given executor (the loop's default one if None),
+        for at most seconds in all, and returns the bounds (lower, upper).
+        The upper bound is only tightened once, when the time is up.
+
+        Cancelling the task stops it after the slice in progress, which
+        finishes in the background; the state it leaves is consistent, and a
+        later run() or run_async() resumes from it."""
+        loop = asyncio.get_running_loop()
+        deadline = None if seconds is None else loop.time() + seconds
+        while not self.done:
+            budget = slice_seconds
+            if deadline is not None:
+                budget = min(budget, deadline - loop.time())
+                if budget <= 0:
+                    await loop.run_in_executor(executor, self.run, 0)
+                    break
+            await loop.run_in_executor(executor, self.run, budget, None, False)
+        return self.lower, self.upper
+
+    def min_cut(self):
+        """The edges of the cut whose capacity is the upper bound; a min cut
+        once done."""
+        return find_min_cut(self.residual_graph, self.residual_graph,
+                            self.source, self._side)
+
+class IncrementalMaxFlow:
+    """Max flow and min cut of a network whose capacities keep changing.
+
+    The residual graph of the last solve is kept, so after a change only the
+    work the change calls for is done: an increase needs only the new
+    augmenting paths, and a decrease that leaves an edge carrying more than its
+    new capacity first reroutes the overflow around the edge, and only sends
+    back to the source (and down from the target) what cannot be rerouted.
+    Both searches start at the changed edge and stop as soon as they succeed.
+
+    The residual graph is a dict of dicts, residual[u][v], so that edges and
+    vertices can be added and removed.
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      adjacency matrix or sparse residual graph of the initial network
+    source, target : int
+      labels of the source and target vertices
+
+    Attributes
+    ----------
+    max_flow : int
+      The max flow from source to target for the current capacities
+    """
+
+    def __init__(self, graph, source, target):
+        self.source = source
+        self.target = target
+        self.capacity = {source: {}, target: {}}
+        self.residual = {source: {}, target: {}}
+        self.max_flow = 0
+        for u, v, c in graph_edges(graph):
+            self._add_capacity(u, v, c)
+        self.max_flow += self._push(source, target)
+
+    def _add_capacity(self, u, v, delta):
+        # Changes both the capacity of u --> v and its residual capacity
+        for w in (u, v):
+            if w not in self.residual:
+                self.capacity[w] = {}
+                self.residual[w] = {}
+        self.capacity[u][v] = self.capacity[u].get(v, 0) + delta
+        self.residual[u][v] = self.residual[u].get(v, 0) + delta
+        self.residual[v].setdefault(u, 0)
+
+    def _push(self, source, target, limit=None):
+        # Augments along shortest residual paths from source to target until
+        # there is none left or limit units have been sent; returns the amount
+        residual = self.residual
+        pushed = 0
+        while limit is None or pushed < limit:
+            parent = {source: None}
+            queue = [source]
+            for u in queue:
+                if target in parent:
+                    break
+                for v, c in residual[u].items():
+                    if c > 0 and v not in parent:
+                        parent[v] = u
+                        queue.append(v)
+            if target not in parent:
+                break
+
+            min_capacity = None if limit is None else limit - pushed
+            v = target
+            while v != source:
+                u = parent[v]
+                if min_capacity is None or residual[u][v] < min_capacity:
+                    min_capacity = residual[u][v]
+                v = u
+            v = target
+            while v != source:
+                u = parent[v]
+                residual[u][v] -= min_capacity
+                residual[v][u] += min_capacity
+                v = u
+            pushed += min_capacity
+        return pushed
+
+    def increase_capacity(self, u, v, delta):
+        """Raises the capacity of u --> v by delta; returns the new max flow."""
+        if delta < 0:
+            raise ValueError("delta must not be negative; use decrease_capacity")
+        self._add_capacity(u, v, delta)
+        self.max_flow += self._push(self.source, self.target)
+        return self.max_flow
+
+    def decrease_capacity(self, u, v, delta):
+        """Lowers the capacity of u --> v by delta; returns the new max flow."""
+        if delta < 0:
+            raise ValueError("delta must not be negative; use increase_capacity")
+        capacity = self.capacity.get(u, {}).get(v, 0)
+        if delta > capacity:
+            raise ValueError("edge %r --> %r has capacity %r, cannot remove %r"
+                             % (u, v, capacity, delta))
+        self.capacity[u][v] = capacity - delta
+
+        # The flow on u --> v is its capacity minus its residual capacity. What
+        # the lower capacity can still carry stays; the rest, the overflow, is
+        # taken off the edge, which leaves u with excess flow and v short.
+        residual = self.residual
+        overflow = max(0, delta - residual[u][v])
+        residual[u][v] -= delta - overflow
+        if overflow:
+            residual[v][u] -= overflow
+
+            # Send the excess at u on to v around the edge, if possible
+            rerouted = self._push(u, v, overflow)
+            overflow -= rerouted
+            if overflow:
+                # Otherwise cancel it: back from u to the source, and from the
+                # target back to v, which lowers the max flow
+                self._push(u, self.source, overflow)
+                self._push(self.target, v, overflow)
+                self.max_flow -= overflow
+
+        # Lowering a capacity can free flow that has been cancelled above
+        self.max_flow += self._push(self.source, self.target)
+        return self.max_flow
+
+    def add_edge(self, u, v, capacity):
+        """Adds the edge u --> v; returns the new max flow."""
+        if self.capacity.get(u, {}).get(v, 0) > 0:
+            raise ValueError("edge %r --> %r already exists" % (u, v))
+        return self.increase_capacity(u, v, capacity)
+
+    def remove_edge(self, u, v):
+        """Removes the edge u --> v; returns the new max flow."""
+        capacity = self.capacity.get(u, {}).get(v, 0)
+        if capacity <= 0:
+            raise ValueError("edge %r --> %r does not exist" % (u, v))
+        self.decrease_capacity(u, v, capacity)
+        del self.capacity[u][v]
+        return self.max_flow
+
+    def min_cut(self):
+        """Returns the min cut edges for the current capacities, as (u, v)
+        tuples in the same order as find_min_cut."""
+        reachable = {self.source}
+        queue = [self.source]
+        for u in queue:
+            for v, c in self.residual[u].items():
+                if c > 0 and v not in reachable:
+                    reachable.add(v)
+                    queue.append(v)
+        return sorted((u, v) for u in reachable
+                      for v, c in self.capacity[u].items()
+                      if c > 0 and v not in reachable)
+
+class GomoryHuTree:
+    """Gomory-Hu tree of an undirected flow network, for all-pairs min cuts.
+
+    The tree has the same vertices as the graph, and for any two vertices u and
+    v, the lightest tree edge on the path between them has the weight of the
+    minimum u-v cut; removing that edge splits the vertices into the two sides
+    of the cut. Gusfield's algorithm builds the tree with n-1 max-flow
+    computations on the original graph, with whichever engine is chosen.
+
+    Inputs
+    ------
+    graph : list or ResidualGraph
+      symmetric adjacency matrix (or ResidualGraph) of an undirected graph
+    algorithm : str
+      name of the max-flow engine; see solve
+
+    Attributes
+    ----------
+    n : int
+      number of vertices
+    parent, weight : list
+      tree edges: vertex v > 0 is joined to parent[v] by an edge of weight[v];
+      vertex 0 is the root
+    edges : list
+      (u, v, capacity) undirected edges of the graph, with u < v
+    """
+
+    def __init__(self, graph, algorithm='dinic'):
+        capacities = {}  # Parallel edges add up
+        for u, v, c in graph_edges(graph):
+            capacities[u, v] = capacities.get((u, v), 0) + c
+        for (u, v), c in capacities.items():
+            if capacities.get((v, u)) != c:
+                raise ValueError("a Gomory-Hu tree needs an undirected graph, "
+                                 "but edge %r --> %r has no matching edge back"
+                                 % (u, v))
+        n = graph.n if isinstance(graph, ResidualGraph) else len(graph)
+        if algorithm != 'numpy':
+            graph = as_residual_graph(graph)  # built once, copied per max flow
+
+        parent = [0] * n
+        weight = [0] * n
+        for s in range(1, n):
+            t = parent[s]
+            max_flow, residual_graph, reachable = solve(graph, s, t, algorithm)
+            if reachable is None:
+                reachable = bfs_reachable_nodes(residual_graph, s)
+            weight[s] = max_flow
+            # Vertices on the side of s of this cut that hung from t now hang
+            # from s; if t's own parent is on that side, s takes t's place
+            for v in range(n):
+                if v != s and reachable[v] and parent[v] == t:
+                    parent[v] = s
+            if reachable[parent[t]]:
+                parent[s] = parent[t]
+                parent[t] = s
+                weight[s] = weight[t]
+                weight[t] = max_flow
+
+        self.n = n
+        self.parent = parent
+        self.weight = weight
+        self.edges = sorted((u, v, c) for (u, v), c in capacities.items() if u < v)
+        self._setup()
+
+    def _setup(self):
+        # Children and depths for walking the tree, and a cache of cuts by
+        # tree edge
+        self.children = [[] for _ in range(self.n)]
+        for v in range(1, self.n):
+            self.children[self.parent[v]].append(v)
+        self.depth = [0] * self.n
+        queue = [0] if self.n else []
+        for u in queue:
+            for v in self.children[u]:
+                self.depth[v] = self.depth[u] + 1
+                queue.append(v)
+        self._cuts = {}
+
+    def _lightest_edge(self, u, v):
+        # The child end of the lightest tree edge between u and v
+        if u == v:
+            raise ValueError("u and v must be different vertices")
+        parent, weight, depth = self.parent, self.weight, self.depth
+        lightest = None
+        while u != v:
+            if depth[u] < depth[v]:
+                u, v = v, u
+            if lightest is None or weight[u] < weight[lightest]:
+                lightest = u
+            u = parent[u]
+        return lightest
+
+    def min_cut_value(self, u, v):
+        """Returns the capacity of the minimum cut between u and v, in O(V)."""
+        return self.weight[self._lightest_edge(u, v)]
+
+    def min_cut(self, u, v):
+        """Returns the capacity of the minimum cut between u and v and its
+        edges, as (a, b) tuples with a on the side of u."""
+        child = self._lightest_edge(u, v)
+        if child not in self._cuts:
+            # The side of the cut below the tree edge, and the graph edges
+            # that leave it, oriented away from it
+            below = {child}
+            queue = [child]
+            for w in queue:
+                for x in self.children[w]:
+                    below.add(x)
+                    queue.append(x)
+            self._cuts[child] = (below, sorted(
+                (a, b) if a in below else (b, a)
+                for a, b, c in self.edges if (a in below) != (b in below)))
+        below, cut = self._cuts[child]
+        if u not in below:
+            cut = sorted((b, a) for a, b in cut)
+        return self.weight[child], cut
+
+    def to_dict(self):
+        """Returns the tree and the graph edges as a JSON-friendly dict."""
+        return {'n': self.n, 'parent': self.parent, 'weight': self.weight,
+                'edges': [list(edge) for edge in self.edges]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds a tree saved with to_dict, without any max-flow work."""
+        tree = cls.__new__(cls)
+        tree.n = data['n']
+        tree.parent = list(data['parent'])
+        tree.weight = list(data['weight'])
+        tree.edges = [tuple(edge) for edge in data['edges']]
+        tree._setup()
+        return tree
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+# Residual graphs that solve_batch workers have attached to, by shared
+# memory block name; each block is attached once per worker process
+_shared_graphs = {}
+
+def share_graph(graph):
+    """Copies a ResidualGraph into a shared memory block for solve_batch.
+
+    Returns the block, which the caller closes and unlinks when done, and a
+    small reference to it that workers pass to attach_graph.
+    """
+    n, m = graph.n, len(graph.head)
+    typecode = 'q' if all(isinstance(c, int) for c in graph.cap) else 'd'
+    block = shared_memory.SharedMemory(create=True, size=8 * (n + 1 + 4 * m) or 8)
+    offset = 0
+    for values, code in ((graph.start, 'q'), (graph.head, 'q'), (graph.rev, 'q'),
+                         (graph.cap, typecode), (graph.capacity, typecode)):
+        size = 8 * len(values)
+        block.buf[offset:offset + size].cast(code)[:] = array(code, values)
+        offset += size
+    return block, (block.name, n, m, typecode)
+
+def attach_graph(reference):
+    """Returns the ResidualGraph stored by share_graph, without copying it.
+
+    The arrays of the graph are views of the shared memory block; engines only
+    read them, and copy the residual capacities before changing them.
+    """
+    name, n, m, typecode = reference
+    if name not in _shared_graphs:
+        # Pool workers share the resource tracker of the process that created
+        # the block, so attaching here does not make it unlink the block
+        block = shared_memory.SharedMemory(name=name)
+        graph = ResidualGraph.__new__(ResidualGraph)
+        graph.n = n
+        offset = 0
+        for attribute, size, code in (('start', n + 1, 'q'), ('head', m, 'q'),
+                                      ('rev', m, 'q'), ('cap', m, typecode),
+                                      ('capacity', m, typecode)):
+            setattr(graph, attribute,
+                    block.buf[offset:offset + 8 * size].cast(code))
+            offset += 8 * size
+        _shared_graphs[name] = (block, graph)
+    return _shared_graphs[name][1]
+
+def solve_chunk(chunk, algorithm):
+    """Runs ff_with_min_cut on a list of (index, graph, source, target) tasks in
+    a worker process. Graphs are either passed as they are or as references
+    from share_graph. Returns (index, result) pairs, where the result is the
+    (max_flow, min_cut) tuple or the exception the instance raised."""
+    results = []
+    for index, graph, source, target in chunk:
+        try:
+            if isinstance(graph, tuple):
+                graph = attach_graph(graph)
+            results.append((index, ff_with_min_cut(graph, source, target, algorithm)))
+        except Exception as error:
+            results.append((index, error))
+    return results
+
+def instance_size(graph):
+    """Rough amount of work to solve a graph: its arcs and vertices."""
+    if isinstance(graph, ResidualGraph):
+        return len(graph.head) + graph.n
+    try:
+        return len(graph) * len(graph)
+    except TypeError:
+        return 1  # not a graph; the worker reports the error
+
+def solve_batch(instances, algorithm='dinic', workers=None, share_above=1 << 16):
+    """Solves many independent max-flow instances on a pool of processes.
+
+    Instances are grouped into chunks of roughly equal work, so that many small
+    graphs travel together while a large one gets a worker to itself. A
+    ResidualGraph with more than share_above arcs is copied once into shared
+    memory instead of being pickled with every task, which also lets many
+    (source, target) pairs share one copy of a graph. Results are yielded in
+    the order of the instances, each as soon as it and all the earlier ones
+    are done.
+
+    An instance that raises, or that brings down its worker process, yields
+    its exception instead of a result; the other instances are not affected.
+    Tasks that were running when a worker died are retried one at a time to
+    find the one that caused it.
+
+    Inputs
+    ------
+    instances : iterable
+      (graph, source, target) tuples; the graph is an adjacency matrix or a
+      ResidualGraph, and the same graph object may appear many times
+    algorithm : str
+      name of the max-flow engine; see solve
+    workers : int
+      number of processes; defaults to the number of CPUs
+    share_above : int
+      number of arcs above which a ResidualGraph goes to shared memory
+
+    Yields
+    ------
+    result : tuple or Exception
+      (max_flow, min_cut) of each instance, or the exception it raised
+    """
+    instances = list(instances)
+    workers = workers or os.cpu_count() or 1
+    blocks = []
+    shared = {}  # id of a graph --> reference to its shared memory copy
+    try:
+        tasks = []
+        for index, (graph, source, target) in enumerate(instances):
+            if (isinstance(graph, ResidualGraph) and len(graph.head) > share_above
+                    and algorithm != 'numpy'):
+                if id(graph) not in shared:
+                    block, shared[id(graph)] = share_graph(graph)
+                    blocks.append(block)
+                graph = shared[id(graph)]
+            tasks.append((index, graph, source, target))
+
+        # Chunks of about a quarter of each worker's share of the work
+        sizes = [instance_size(graph) for graph, _, _ in instances]
+        target_size = max(1, sum(sizes) // (4 * workers))
+        chunks, chunk, chunk_size = [], [], 0
+        for task, size in zip(tasks, sizes):
+            chunk.append(task)
+            chunk_size += size
+            if chunk_size >= target_size:
+                chunks.append(chunk)
+                chunk, chunk_size = [], 0
+        if chunk:
+            chunks.append(chunk)
+
+        results = {}
+        next_index = 0
+        suspects = []  # tasks that were running when a worker died
+        with ProcessPoolExecutor(workers) as pool:
+            running = {pool.submit(solve_chunk, chunk, algorithm): chunk
+                       for chunk in chunks}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = running.pop(future)
+                    try:
+                        results.update(future.result())
+                    except BrokenProcessPool:
+                        suspects.extend(chunk)
+                    except Exception as error:  # e.g. a graph that cannot be pickled
+                        results.update((task[0], error) for task in chunk)
+                while next_index in results:
+                    yield results.pop(next_index)
+                    next_index += 1
+
+        # One task at a time on a fresh process, so a crash is pinned on the
+        # instance that caused it
+        for task in sorted(suspects, key=lambda task: task[0]):
+            with ProcessPoolExecutor(1) as pool:
+                try:
+                    results.update(pool.submit(solve_chunk, [task], algorithm).result())
+                except Exception as error:
+                    results[task[0]] = error
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+def parse_capacity(text):
+    """Reads a capacity as an int, or as a float if it is not a whole number."""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def read_dimacs(path, merge=True):
+    """Loads a max-flow problem in DIMACS format.
+
+    The file is read one line at a time:
+
+    ```text
+    c comment
+    p max <vertices> <arcs>
+    n <vertex> s
+    n <vertex> t
+    a <tail> <head> <capacity>
+    ```
+
+    Vertices are numbered from 1 in the file and from 0 in the graph. Arcs go
+    into compact arrays as they are read, and the residual graph is built from
+    those, merging parallel arcs unless merge is False.
+
+    Returns
+    -------
+    graph : ResidualGraph
+      residual graph of the network
+    source, target : int
+      labels of the source and target vertices
+    """
+    tails, heads, caps = array('q'), array('q'), []
+    n = source = target = None
+    with open(path) as lines:
+        for line in lines:
+            fields = line.split()
+            if not fields or fields[0] == 'c':
+                continue
+            if fields[0] == 'a':
+                c = parse_capacity(fields[3])
+                u, v = int(fields[1]) - 1, int(fields[2]) - 1
+                if c > 0 and u != v:
+                    tails.append(u)
+                    heads.append(v)
+                    caps.append(c)
+            elif fields[0] == 'p':
+                if fields[1] != 'max':
+                    raise ValueError("%s: not a max-flow problem: %s" % (path, line.strip()))
+                n = int(fields[2])
+            elif fields[0] == 'n':
+                if fields[2] == 's':
+                    source = int(fields[1]) - 1
+                elif fields[2] == 't':
+                    target = int(fields[1]) - 1
+    if n is None or source is None or target is None:
+        raise ValueError("%s: missing problem, source or target line" % path)
+    return ResidualGraph.from_arrays(tails, heads, caps, n, merge), source, target
+
+def read_edge_list(path, n=None, merge=True):
+    """Loads a graph from a text file with one "u v capacity" edge per line.
+
+    Fields are separated by commas or whitespace, so CSV files work too. Blank
+    lines, lines starting with # and a header line are skipped. Vertices are
+    numbered from 0. Returns a ResidualGraph, built as in read_dimacs.
+    """
+    tails, heads, caps = array('q'), array('q'), []
+    with open(path) as lines:
+        for number, line in enumerate(lines):
+            fields = line.replace(',', ' ').split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            try:
+                u, v, c = int(fields[0]), int(fields[1]), parse_capacity(fields[2])
+            except ValueError:
+                if number == 0:
+                    continue  # header
+                raise
+            if c > 0 and u != v:
+                tails.append(u)
+                heads.append(v)
+                caps.append(c)
+    return ResidualGraph.from_arrays(tails, heads, caps, n, merge)
+
+def read_binary_edges(path, n=None, merge=True):
+    """Loads a graph from a binary file of native 64-bit integers, three per
+    edge: u, v and capacity. The file is memory-mapped, not read into memory.
+    Returns a ResidualGraph, built as in read_dimacs."""
+    tails, heads, caps = array('q'), array('q'), []
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return ResidualGraph.from_arrays(tails, heads, caps, n, merge)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            values = memoryview(mapped).cast('q')
+            try:
+                for i in range(0, len(values) - 2, 3):
+                    u, v, c = values[i], values[i + 1], values[i + 2]
+                    if c > 0 and u != v:
+                        tails.append(u)
+                        heads.append(v)
+                        caps.append(c)
+            finally:
+                values.release()
+    return ResidualGraph.from_arrays(tails, heads, caps, n, merge)
+
+def write_binary_edges(path, edges):
+    """Writes (u, v, capacity) integer edges in the format of read_binary_edges."""
+    with open(path, 'wb') as file:
+        block = array('q')
+        for edge in edges:
+            block.extend(edge)
+            if len(block) >= 3 << 16:
+                block.tofile(file)
+                del block[:]
+        block.tofile(file)
+
+def write_min_cut(path, max_flow, min_cut):
+    """Writes a max flow, as a "# max flow <value>" line, and its min cut, one
+    "u,v" edge per line."""
+    with open(path, 'w') as file:
+        file.write("# max flow %s\n" % max_flow)
+        for u, v in min_cut:
+            file.write("%d,%d\n" % (u, v))
+
+def write_dimacs_flow(path, max_flow, residual_graph):
+    """Writes a flow in the DIMACS solution format: an "s <value>" line and an
+    "f <tail> <head> <flow>" line for every arc with flow, numbered from 1.
+
+    The residual graph must hold a flow, not a preflow; see push_relabel.
+    """
+    start, head = residual_graph.start, residual_graph.head
+    capacity, cap = residual_graph.capacity, residual_graph.cap
+    with open(path, 'w') as file:
+        file.write("s %s\n" % max_flow)
+        for u in range(residual_graph.n):
+            for a in range(start[u], start[u + 1]):
+                if capacity[a] > 0 and cap[a] < capacity[a]:
+                    file.write("f %d %d %s\n" % (u + 1, head[a] + 1, capacity[a] - cap[a]))
+
+# Offsets (row, column) of the neighbours of a pixel, one per pair of neighbours
+GRID_NEIGHBOURS = {
+    4: ((0, 1), (1, 0)),
+    8: ((0, 1), (1, 0), (1, 1), (1, -1)),
+}
+
+def flat_list(values):
+    """Returns per-pixel values, a flat sequence in row-major order or a 2D
+    ndarray, as a flat list."""
+    if np is not None and isinstance(values, np.ndarray):
+        return values.ravel().tolist()
+    return list(values)
+
+def grid_edges(height, width, source_caps, sink_caps, weights, connectivity=4):
+    """Yields the (u, v, capacity) edges of the network that boykov_kolmogorov
+    solves, with the source as vertex height * width and the target as vertex
+    height * width + 1, e.g. to check it against the other engines."""
+    n = height * width
+    source_caps, sink_caps = flat_list(source_caps), flat_list(sink_caps)
+    for p in range(n):
+        yield n, p, source_caps[p]
+        yield p, n + 1, sink_caps[p]
+    for (dr, dc), weight in zip(GRID_NEIGHBOURS[connectivity], weights):
+        weight = flat_list(weight)
+        for r in range(max(0, -dr), min(height, height - dr)):
+            for c in range(max(0, -dc), min(width, width - dc)):
+                p = r * width + c
+                q = p + dr * width + dc
+                yield p, q, weight[p]
+                yield q, p, weight[p]
+
+def boykov_kolmogorov(height, width, source_caps, sink_caps, weights,
+                      connectivity=4, stats=None):
+    """Boykov-Kolmogorov max flow and min cut of a pixel grid.
+
+    The network has a vertex per pixel, an edge from the source to every
+    pixel and from every pixel to the target, and an edge both ways between
+    neighbouring pixels. It is given by per-pixel arrays instead of an
+    adjacency structure; the neighbours of a pixel are found from its
+    position, and the residual capacities are kept in one flat list per
+    direction.
+
+    Two search trees are grown, one from the source along arcs with residual
+    capacity and one from the target along arcs with residual capacity
+    towards it. When they touch, the path through both trees is augmented.
+    The saturated arcs leave orphans, which are adopted by another vertex of
+    their tree if one is still rooted at the terminal, or else become free and
+    let their neighbours grow into them again. Unlike breadth-first engines,
+    the trees are kept from one augmentation to the next, which is much faster
+    on the short paths of grid graphs.
+
+    Inputs
+    ------
+    height, width : int
+      size of the grid
+    source_caps, sink_caps : sequence
+      capacity of the edge from the source to every pixel and from every pixel
+      to the target, flat in row-major order (or 2D ndarrays)
+    weights : list
+      one array of height * width capacities per offset in
+      GRID_NEIGHBOURS[connectivity]: weights[i][p] is the capacity between
+      pixel p and its neighbour at that offset, both ways; entries for
+      neighbours outside of the grid are ignored. For 4-connectivity, these
+      are the right and lower neighbours; for 8-connectivity, also the lower
+      right and lower left ones.
+    connectivity : int
+      4 or 8
+    stats : dict
+      optional counters: augmentations, orphans and edges_scanned
+
+    Returns
+    -------
+    max_flow : int
+      The max flow that can travel from the source to the target
+    labels : bytearray
+      for every pixel, 0 if the source reaches it in the final residual graph
+      and 1 otherwise: the sides of the min cut that find_min_cut reports
+    """
+    if connectivity not in GRID_NEIGHBOURS:
+        raise ValueError("connectivity must be 4 or 8, not %r" % (connectivity,))
+    offsets = GRID_NEIGHBOURS[connectivity]
+    if len(weights) != len(offsets):
+        raise ValueError("expected %d weight arrays for %d-connectivity, got %d"
+                         % (len(offsets), connectivity, len(weights)))
+    n = height * width
+
+    # Arc direction 2i follows offsets[i] and 2i+1 goes the opposite way, so
+    # d ^ 1 is the reverse of d. res[d][p] is the residual capacity of the arc
+    # from p to p + shift[d], and stays 0 for arcs that leave the grid.
+    shift = []
+    for dr, dc in offsets:
+        shift += [dr * width + dc, -dr * width - dc]
+    directions = range(len(shift))
+    res = [[0] * n for _ in shift]
+    for i, (dr, dc) in enumerate(offsets):
+        weight = flat_list(weights[i])
+        forward, backward = res[2 * i], res[2 * i + 1]
+        for r in range(max(0, -dr), min(height, height - dr)):
+            for c in range(max(0, -dc), min(width, width - dc)):
+                p = r * width + c
+                forward[p] = weight[p]
+                backward[p + shift[2 * i]] = weight[p]
+
+    # Flow along source -> p -> target needs no search: send it at once, and
+    # keep the residual capacity of the terminal edges in one number,
+    # positive from the source and negative towards the target
+    source_caps, sink_caps = flat_list(source_caps), flat_list(sink_caps)
+    max_flow = 0
+    terminal = [0] * n
+    for p in range(n):
+        max_flow += min(source_caps[p], sink_caps[p])
+        terminal[p] = source_caps[p] - sink_caps[p]
+
+    FREE, SOURCE, SINK = 0, 1, 2
+    ROOT, ORPHAN = -1, -2  # parent of the vertices linked to a terminal, or to none
+    tree = bytearray(n)
+    parent = [ORPHAN] * n  # otherwise, the direction of the arc to the parent
+    stamp = [0] * n  # last adoption stage that found the vertex rooted
+    active = deque()
+    for p in range(n):
+        if terminal[p]:
+            tree[p] = SOURCE if terminal[p] > 0 else SINK
+            parent[p] = ROOT
+            active.append(p)
+
+    counts = {'orphans': 0, 'edges_scanned': 0}
+    stage = 0
+    while True:
+        # Growth: extend the trees from their active vertices until they touch
+        bridge = None
+        while active:
+            p = active[0]
+            side = tree[p]
+            if side == FREE:
+                active.popleft()  # freed since it was activated
+                continue
+            counts['edges_scanned'] += len(shift)
+            for d in directions:
+                q = p + shift[d]
+                # Source trees grow along arcs p --> q, sink trees along q --> p
+                if side == SOURCE:
+                    if res[d][p] <= 0:
+                        continue
+                elif not 0 <= q < n or res[d ^ 1][q] <= 0:
+                    continue
+                if tree[q] == FREE:
+                    tree[q] = side
+                    parent[q] = d ^ 1
+                    active.append(q)
+                elif tree[q] != side:
+                    bridge = (p, d) if side == SOURCE else (q, d ^ 1)
+                    break
+            if bridge is not None:
+                break  # p stays active: it may touch the other tree again
+            active.popleft()
+        if bridge is None:
+            break
+
+        # Augment along source tree -> bridge arc p --> q -> sink tree
+        p, d = bridge
+        q = p + shift[d]
+        bottleneck = res[d][p]
+        length = 1
+        u = p
+        while parent[u] != ROOT:
+            e = parent[u]
+            v = u + shift[e]
+            bottleneck = min(bottleneck, res[e ^ 1][v])  # v --> u
+            u = v
+            length += 1
+        bottleneck = min(bottleneck, terminal[u])
+        u = q
+        while parent[u] != ROOT:
+            e = parent[u]
+            bottleneck = min(bottleneck, res[e][u])  # u --> its parent
+            u += shift[e]
+            length += 1
+        bottleneck = min(bottleneck, -terminal[u])
+
+        orphans = []
+        res[d][p] -= bottleneck
+        res[d ^ 1][q] += bottleneck
+        u = p
+        while parent[u] != ROOT:
+            e = parent[u]
+            v = u + shift[e]
+            res[e ^ 1][v] -= bottleneck
+            res[e][u] += bottleneck
+            if res[e ^ 1][v] == 0:
+                parent[u] = ORPHAN
+                orphans.append(u)
+            u = v
+        terminal[u] -= bottleneck
+        if terminal[u] == 0:
+            parent[u] = ORPHAN
+            orphans.append(u)
+        u = q
+        while parent[u] != ROOT:
+            e = parent[u]
+            v = u + shift[e]
+            res[e][u] -= bottleneck
+            res[e ^ 1][v] += bottleneck
+            if res[e][u] == 0:
+                parent[u] = ORPHAN
+                orphans.append(u)
+            u = v
+        terminal[u] += bottleneck
+        if terminal[u] == 0:
+            parent[u] = ORPHAN
+            orphans.append(u)
+        max_flow += bottleneck
+        augmented(stats, length + 1, bottleneck)
+
+        # Adoption: find every orphan a new parent in its tree, or free it
+        stage += 1
+        while orphans:
+            u = orphans.pop()
+            counts['orphans'] += 1
+            side = tree[u]
+            adopted = False
+            for e in directions:
+                v = u + shift[e]
+                if not 0 <= v < n or tree[v] != side:
+                    continue
+                if (res[e ^ 1][v] if side == SOURCE else res[e][u]) <= 0:
+                    continue
+                # v will do if its own parents lead to the terminal; the
+                # vertices found rooted in this stage need not be walked again
+                walked = []
+                w = v
+                while stamp[w] != stage and parent[w] >= 0:
+                    walked.append(w)
+                    w += shift[parent[w]]
+                if stamp[w] == stage or parent[w] == ROOT:
+                    for w in walked:
+                        stamp[w] = stage
+                    parent[u] = e
+                    adopted = True
+                    break
+            if adopted:
+                continue
+
+            for e in directions:
+                v = u + shift[e]
+                if not 0 <= v < n or tree[v] != side:
+                    continue
+                if (res[e ^ 1][v] if side == SOURCE else res[e][u]) > 0:
+                    active.append(v)  # v may grow into u again
+                if parent[v] >= 0 and v + shift[parent[v]] == u:
+                    parent[v] = ORPHAN
+                    orphans.append(v)
+            tree[u] = FREE
+            parent[u] = ORPHAN
+
+    tally(stats, **counts)
+
+    # Label the pixels the source reaches in the residual graph
+    labels = bytearray(b'\x01') * n
+    queue = [p for p in range(n) if terminal[p] > 0]
+    for p in queue:
+        labels[p] = 0
+    for p in queue:
+        for d in directions:
+            q = p + shift[d]
+            if res[d][p] > 0 and labels[q]:
+                labels[q] = 0
+                queue.append(q)
+    return max_flow, labels
+
+# Benchmark graph generators. Each takes the approximate number of edges and a
+# seed, and returns (edges, n, source, target) with edges as (u, v, capacity).
+
+def random_sparse_graph(size, seed=0, degree=10, max_capacity=100):
+    """Random graph whose vertices have degree edges to random vertices."""
+    rng = random.Random(seed)
+    n = max(2, size // degree)
+    edges = [(u, rng.randrange(n), rng.randint(1, max_capacity))
+             for u in range(n) for _ in range(degree)]
+    return edges, n, 0, n - 1
+
+def grid_graph(size, seed=0, max_capacity=100):
+    """Square grid in the style of the AK and Washington generators: the
+    source feeds the first column, the last column drains into the target, and
+    flow moves right, up and down between neighbouring cells."""
+    rng = random.Random(seed)
+    side = max(2, int((size / 4) ** 0.5))
+    n = side * side + 2
+    source, target = n - 2, n - 1
+    edges = []
+    for row in range(side):
+        edges.append((source, row * side, max_capacity * side))
+        edges.append((row * side + side - 1, target, max_capacity * side))
+        for col in range(side):
+            u = row * side + col
+            if col + 1 < side:
+                edges.append((u, u + 1, rng.randint(1, max_capacity)))
+            if row + 1 < side:
+                edges.append((u, u + side, rng.randint(1, max_capacity)))
+                edges.append((u + side, u, rng.randint(1, max_capacity)))
+    return edges, n, source, target
+
+def bipartite_graph(size, seed=0, degree=3):
+    """Unit-capacity bipartite matching instance with a super-source and a
+    super-sink, each left vertex joined to degree random right vertices."""
+    rng = random.Random(seed)
+    half = max(1, size // (degree + 2))
+    n = 2 * half + 2
+    source, target = n - 2, n - 1
+    edges = [(source, u, 1) for u in range(half)]
+    edges += [(half + v, target, 1) for v in range(half)]
+    edges += [(u, half + v, 1) for u in range(half)
+              for v in rng.sample(range(half), min(degree, half))]
+    return edges, n, source, target
+
+def complete_graph(size, seed=0, max_capacity=100):
+    """Dense graph with an edge of random capacity between every two vertices."""
+    rng = random.Random(seed)
+    n = max(2, int(size ** 0.5))
+    edges = [(u, v, rng.randint(1, max_capacity))
+             for u in range(n) for v in range(n) if u != v]
+    return edges, n, 0, n - 1
+
+def chain_graph(size, seed=0, max_capacity=100):
+    """A single long path, deep enough to break recursive path searches."""
+    rng = random.Random(seed)
+    n = max(2, size + 1)
+    edges = [(u, u + 1, rng.randint(1, max_capacity)) for u in range(n - 1)]
+    return edges, n, 0, n - 1
+
+def adversarial_graph(size, seed=0, capacity=10 ** 12, levels=20):
+    """Ladders of levels rungs side by side, built against the depth-first
+    search of ford-fulkerson. The source feeds the a end of every rung and
+    the b end of every rung drains into the target, and edges of a huge
+    capacity cross from a to b between neighbouring rungs. Edges of capacity 1
+    lead from b to a within a rung and down both rails. The search takes the
+    highest numbered vertex first, so it zig-zags down these edges one unit at
+    a time, and its augmentations grow with capacity until about
+    3 * levels ** 2 / 4 per ladder, while the other engines need levels each."""
+    copies = max(1, size // (7 * levels))
+    n = 2 * levels * copies + 2
+    source, target = n - 2, n - 1
+    edges = []
+    for i in range(copies):
+        for a in range(2 * levels * i, 2 * levels * (i + 1), 2):
+            b = a + 1
+            edges += [(source, a, capacity), (b, target, capacity), (b, a, 1)]
+            if b + 1 < 2 * levels * (i + 1):
+                edges += [(a, b + 2, capacity), (a + 2, b, capacity),
+                          (a + 2, a, 1), (b + 2, b, 1)]
+    return edges, n, source, target
+
+GENERATORS = {
+    'random-sparse': random_sparse_graph,
+    'grid': grid_graph,
+    'bipartite': bipartite_graph,
+    'complete': complete_graph,
+    'chain': chain_graph,
+    'adversarial': adversarial_graph,
+}
+
+def is_min_cut(edges, source, target, max_flow, min_cut):
+    """Checks that removing the min cut edges disconnects the target from the
+    source, and that their total capacity equals the max flow."""
+    cut = set(min_cut)
+    if sum(c for u, v, c in edges if (u, v) in cut) != max_flow:
+        return False
+    neighbours = {}
+    for u, v, c in edges:
+        if c > 0 and (u, v) not in cut:
+            neighbours.setdefault(u, []).append(v)
+    reached = {source}
+    stack = [source]
+    while stack:
+        for v in neighbours.get(stack.pop(), ()):
+            if v not in reached:
+                reached.add(v)
+                stack.append(v)
+    return target not in reached
+
+def run_benchmarks(sizes=(1000, 10000), engines=None, families=None, seed=0,
+                   output=None, memory=False, dense_limit=1000):
+    """Times every engine on every generated graph and checks their answers.
+
+    Inputs
+    ------
+    sizes : iterable
+      approximate numbers of edges of the generated graphs
+    engines, families : iterable
+      names from ENGINES and GENERATORS; all of them by default. The 'numpy'
+      engine only runs when NumPy is installed and the graph has at most
+      dense_limit vertices, and 'hopcroft-karp' only on bipartite matching
+      networks.
+    seed : int
+      seed of the generators, so that runs can be compared
+    output : str
+      path of a JSON file to save the results to
+    memory : bool
+      whether to measure peak memory, in a second run under tracemalloc; off
+      by default, since tracemalloc slows every allocation down many times
+
+    Returns
+    -------
+    records : list
+      one dict per (family, size, engine) run, with the wall time in seconds,
+      peak_bytes, the engine's counters (augmentations, edges_scanned, ...),
+      valid_cut, and agrees: whether every engine found the same max flow
+    """
+    engines = list(engines or ENGINES)
+    records = []
+    for family in families or GENERATORS:
+        for size in sizes:
+            edges, n, source, target = GENERATORS[family](size, seed)
+            bipartite = unit_bipartite(ResidualGraph(edges, n), source, target)
+            runs = []
+            for engine in engines:
+                if engine == 'hopcroft-karp' and bipartite is None:
+                    continue
+                if engine == 'numpy':
+                    if np is None or n > dense_limit:
+                        continue
+                    graph = np.zeros((n, n), dtype=np.int64)
+                    for u, v, c in edges:
+                        if u != v:
+                            graph[u, v] += c
+                else:
+                    graph = ResidualGraph(edges, n)
+
+                stats = {}
+                started = time.perf_counter()
+                max_flow, min_cut = ff_with_min_cut(graph, source, target, engine, stats)
+                seconds = time.perf_counter() - started
+
+                peak_bytes = None
+                if memory:
+                    tracemalloc.start()
+                    ff_with_min_cut(graph, source, target, engine)
+                    peak_bytes = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                record = {'family': family, 'size': size, 'vertices': n,
+                          'edges': len(edges), 'engine': engine, 'seed': seed,
+                          'max_flow': max_flow, 'seconds': seconds,
+                          'peak_bytes': peak_bytes,
+                          'valid_cut': is_min_cut(edges, source, target, max_flow, min_cut)}
+                record.update(stats)
+                runs.append(record)
+
+            agrees = len({record['max_flow'] for record in runs}) <= 1
+            for record in runs:
+                record['agrees'] = agrees
+            records.extend(runs)
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump({'python': platform.python_version(), 'records': records},
+                      file, indent=1, sort_keys=True)
+    return records
+
+def print_benchmarks(records):
+    """Prints benchmark records as a table, flagging wrong answers."""
+    print("%-14s %8s %8s %-16s %10s %10s %12s %14s  %s" % (
+        'family', 'size', 'vertices', 'engine', 'seconds', 'peak KiB',
+        'augment.', 'edges scanned', 'check'))
+    for r in records:
+        peak = '-' if r['peak_bytes'] is None else r['peak_bytes'] // 1024
+        check = 'ok' if r['valid_cut'] and r['agrees'] else 'MISMATCH'
+        print("%-14s %8d %8d %-16s %10.4f %10s %12s %14s  %s" % (
+            r['family'], r['size'], r['vertices'], r['engine'], r['seconds'],
+            peak, r.get('augmentations', '-'),
+            r.get('edges_scanned', '-'), check))
+
 # Example Test Graph (same as in the assignment)
 G = [  # A   B   C   D   E
      [  0, 20,  0,  0,  0],  # A
@@ -431,4 +3221,11 @@ G = [  # A   B   C   D   E
 # Run the function
 max_flow, min_cut = ff_with_min_cut(G, 0, 4)  # A is 0, E is 4
 print("Max Flow:", max_flow)
-print("Min Cut:", min_cut)
\ No newline at end of file
+print("Min Cut:", min_cut)
+
+# Run the benchmarks with: python <this file> benchmark [results.json]
+if __name__ == '__main__' and sys.argv[1:2] == ['benchmark']:
+    arguments = sys.argv[2:]
+    memory = '--memory' in arguments
+    paths = [argument for argument in arguments if argument != '--memory']
+    print_benchmarks(run_benchmarks(output=paths[0] if paths else None, memory=memory))